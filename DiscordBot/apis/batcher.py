@@ -0,0 +1,64 @@
+import asyncio
+
+
+class MicroBatcher:
+    '''
+    Collects items submitted by many coroutines and hands them to batch_fn together, either 
+    once max_batch_size items are waiting or max_delay seconds after the first one arrived.
+    batch_fn is an async function taking a list of items and returning a list of results
+    in the same order; each submitter gets back its own result.
+    '''
+
+    def __init__(self, batch_fn, max_batch_size=8, max_delay=0.02):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future))
+
+        if len(self.pending) >= self.max_batch_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending[:self.max_batch_size], self.pending[self.max_batch_size:]
+        if self.pending:
+            self.timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+        if batch:
+            # Keep a reference so the task isn't garbage collected while it runs
+            task = asyncio.create_task(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.batch_fn([item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "pending": len(self.pending),
+        }
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from collections import deque
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    '''
+    Tracks the outcome and latency of the last window calls to a provider. If too many of them
+    failed or were slow the breaker opens and callers skip the provider straight away. While open,
+    a background probe retries the provider every cooldown seconds and closes the breaker once 
+    the probe succeeds in time.
+    '''
+
+    def __init__(self, name, window=20, min_calls=5, error_rate=0.5, slow_call=None, slow_rate=0.5, cooldown=30.0, probe=None):
+        self.name = name
+        self.calls = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self.probe = probe
+        self.state = CLOSED
+        self.opened_at = None
+        self.probe_task = None
+        self.trips = 0
+
+    def allow(self):
+        return self.state == CLOSED
+
+    def _is_slow(self, latency):
+        return self.slow_call is not None and latency > self.slow_call
+
+    def record(self, ok, latency):
+        if self.state != CLOSED:
+            return
+        self.calls.append((ok, self._is_slow(latency)))
+        if len(self.calls) < self.min_calls:
+            return
+
+        errors = sum(1 for ok, _ in self.calls if not ok) / len(self.calls)
+        slow = sum(1 for _, is_slow in self.calls if is_slow) / len(self.calls)
+        if errors >= self.error_rate or slow >= self.slow_rate:
+            self.trip()
+
+    def trip(self):
+        print(f"Circuit breaker for {self.name} opened")
+        self.state = OPEN
+        self.opened_at = time.time()
+        self.trips += 1
+        if self.probe is not None and (self.probe_task is None or self.probe_task.done()):
+            self.probe_task = asyncio.create_task(self._probe_until_closed())
+
+    def close(self):
+        print(f"Circuit breaker for {self.name} closed")
+        self.state = CLOSED
+        self.opened_at = None
+        self.calls.clear()
+
+    async def _probe_until_closed(self):
+        while self.state != CLOSED:
+            await asyncio.sleep(self.cooldown)
+            self.state = HALF_OPEN
+            start = time.perf_counter()
+            try:
+                await self.probe()
+                if not self._is_slow(time.perf_counter() - start):
+                    self.close()
+                    return
+            except Exception as e:
+                print(f"Circuit breaker probe for {self.name} failed: {e}")
+            self.state = OPEN
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "trips": self.trips,
+            "recent_calls": len(self.calls),
+            "recent_errors": sum(1 for ok, _ in self.calls if not ok),
+        }
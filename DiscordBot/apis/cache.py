@@ -0,0 +1,135 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_text(text):
+    # Copypasta tends to differ only in case and spacing
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
+
+def text_key(text):
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class SqliteCacheBackend:
+    '''
+    On-disk store for TTLCache so entries survive a restart. Values must be JSON serializable.
+    Reads don't write: access times are remembered and saved with the next set, and old rows
+    are only evicted once the table has grown past max_size.
+    '''
+
+    def __init__(self, path, max_size=100000):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL, accessed REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self.conn.commit()
+        self.accessed = {} # Map from keys read since the last set to when they were read
+        # Upper bound on the rows in the table, replacing a key counts as adding one
+        self.rows = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires < time.time():
+                # Deleted by the next eviction
+                return None
+            self.accessed[key] = time.time()
+            return json.loads(value), expires
+
+    def set(self, key, value, expires):
+        with self.lock:
+            if self.accessed:
+                self.conn.executemany("UPDATE cache SET accessed = ? WHERE key = ?", [(accessed, key) for key, accessed in self.accessed.items()])
+                self.accessed = {}
+            self.conn.execute("INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                              (key, json.dumps(value), expires, time.time()))
+            self.rows += 1
+            if self.rows > self.max_size:
+                # Drop expired rows, then the least recently used ones down to 90% of the limit,
+                # so the next eviction is a while off
+                self.conn.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+                self.conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_size - self.max_size // 10,))
+                self.rows = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class TTLCache:
+    '''
+    Size bounded LRU cache where every entry also expires after ttl seconds (never if ttl is None).
+    An optional backend is checked on a memory miss and written through on every set.
+    '''
+
+    def __init__(self, max_size=1024, ttl=None, backend=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                value, expires = self.entries[key]
+                if expires is None or expires >= time.time():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+
+        if self.backend is not None:
+            stored = self.backend.get(key)
+            if stored is not None:
+                value, expires = stored
+                with self.lock:
+                    self._put(key, value, expires)
+                    self.hits += 1
+                return value
+
+        with self.lock:
+            self.misses += 1
+        return default
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self._put(key, value, expires)
+        if self.backend is not None:
+            self.backend.set(key, value, expires)
+
+    def _put(self, key, value, expires):
+        self.entries[key] = (value, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+        }
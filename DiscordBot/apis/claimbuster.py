@@ -1,8 +1,9 @@
-from collections import Counter
-import requests
+from urllib.parse import quote
 
-from apis.helper import get_config, MISINFO, NOT_MISINFO, UNCLEAR
-from apis.embedding import TextAnalysis
+from apis.helper import get_config, get_http_budget, run_blocking, UNCLEAR
+from apis.consensus import classify_facts, NO_MATCHES_MSG
+from apis.embedding import create_text_analysis
+from apis.httpclient import get_http_client
 
 
 class ClaimBuster:
@@ -17,73 +18,46 @@ class ClaimBuster:
     def __init__(self):
         config = get_config()
         self.request_headers = {"x-api-key": config['CLAIMBUSTER_API']}
-        self.text_analysis = TextAnalysis()
-
-    def get_fact_score(self, claim):
-        curr_url = self.KNOWLEDGE_BASE_ENDPOINT.format(claim=claim)
-        api_response = requests.get(url=curr_url, headers=self.request_headers)
-        print(api_response.json())
+        self.timeout = float(config.get('CLAIMBUSTER_HTTP_TIMEOUT', 5))
+        self.budget = get_http_budget("claimbuster")
+        self.text_analysis = create_text_analysis()
+        self.http = get_http_client()
+
+    def _endpoint_url(self, endpoint, claim):
+        # The claim is part of the path, so slashes and question marks have to be escaped too
+        return endpoint.format(claim=quote(claim, safe=''))
+
+    async def _get_json(self, url):
+        return await self.http.get_json(url, headers=self.request_headers, timeout=self.timeout, budget=self.budget)
+
+    async def get_fact_score(self, claim):
+        curr_url = self._endpoint_url(self.KNOWLEDGE_BASE_ENDPOINT, claim)
+        api_json = await self._get_json(curr_url)
+        print(api_json)
         
 
-    def get_matching_facts(self, claim, threshold=0.75):
-        curr_url = self.FACT_MATCHER_ENDPOINT.format(claim=claim)
-        api_response = requests.get(url=curr_url, headers=self.request_headers)
-        classification_result, examples = self._parse_get_matching_facts(api_response.json(), threshold)
+    async def get_matching_facts(self, claim, threshold=0.75, use_cache=True):
+        curr_url = self._endpoint_url(self.FACT_MATCHER_ENDPOINT, claim)
+        api_json = await self._get_json(curr_url)
+        # The embedding and entailment models are CPU bound, so keep them off the event loop
+        classification_result, examples = await run_blocking(self._parse_get_matching_facts, api_json, threshold, use_cache)
         return classification_result, examples
 
 
-    def _parse_get_matching_facts(self, payload, threshold):
-        # For each similar fact, get the true/false sentiment of the example
-        payload_emb = self.text_analysis.embed(payload['claim'])
-
-        counts = Counter(MISINFO=0, NOT_MISINFO=0, UNCLEAR=0)
-        supporting_facts = []
-        for fact in payload['justification']:
-            # Generate embedding similarity
-            curr_emb = self.text_analysis.embed(fact['claim'])
-            curr_emb_sim = self.text_analysis.embed_sim(payload_emb, curr_emb)
-
-            if curr_emb_sim > threshold:
-                # Generate a positive/negative true/false classifier for the truth rating
-                #category = self.text_analysis.get_sentiment(fact['truth_rating'])
-
-                # First check if the user input and the verified fact entail one another
-                #  - if yes, then result entailment would mean not minsinfo
-                #  - if no, then result entailment would mean misinfo
-                claim_entailment = self.text_analysis.is_entailment(payload['claim'], fact['claim'], input_type='claim')
-
-                result_entailment = self.text_analysis.is_entailment(fact['claim'], fact['truth_rating'], input_type='result')
-
-                if claim_entailment:
-                    category = MISINFO
-                    if result_entailment:
-                        category = NOT_MISINFO
-                else:
-                    category = NOT_MISINFO
-                    if result_entailment:
-                        category = MISINFO
-
-                counts[category] += 1
-
-                supporting_facts.append({
-                    "status": category,
-                    "truth_rating": fact['truth_rating'],
-                    "claim": fact['claim'],
-                    "source": fact['search'],
-                    "url": fact['url'],
-                    "sim": curr_emb_sim,
-                    "formatted_msg": f"Sim to current post: {curr_emb_sim}, Conclusion: {category}, URL supporting conlusion: {fact['url']}"
-                })
-
-        supporting_facts.sort(key=lambda x: x['sim'], reverse=True)
-    
+    def _parse_get_matching_facts(self, payload, threshold, use_cache=True):
+        facts = [{
+            "claim": fact['claim'],
+            "truth_rating": fact['truth_rating'],
+            "source": fact['search'],
+            "url": fact['url'],
+        } for fact in payload['justification']]
+
+        classification, supporting_facts = classify_facts(self.text_analysis, payload['claim'], facts, threshold, use_cache=use_cache)
         if len(supporting_facts) == 0:
-            return UNCLEAR, [{"formatted_msg": "No similar crowd sourced reporting has verified the validity of this statement"}]
+            return UNCLEAR, [{"formatted_msg": NO_MATCHES_MSG}]
 
-        # If one category has over 66%, then conclude that the class is correct. Otherwise say it is unclear
-        classification, count = counts.most_common(1)[0]
-        if count < len(supporting_facts) * 0.66:
-            classification = UNCLEAR
+        for fact in supporting_facts:
+            fact["formatted_msg"] = f"Sim to current post: {fact['sim']}, Conclusion: {fact['status']}, URL supporting conlusion: {fact['url']}"
 
         # Return the consensus if there is a clear majority and the list of similar claims + verifications
         return classification, supporting_facts
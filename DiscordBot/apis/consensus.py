@@ -0,0 +1,96 @@
+from collections import Counter
+
+from apis.helper import MISINFO, NOT_MISINFO, UNCLEAR
+
+
+NO_MATCHES_MSG = "No similar crowd sourced reporting has verified the validity of this statement"
+
+
+def has_supporting_facts(examples):
+    # Providers return a single placeholder message when nothing matched
+    return any("status" in example for example in examples)
+
+
+def classify_facts(text_analysis, orig_claim, facts, threshold, sims=None, use_cache=True):
+    '''
+    Shared consensus logic for the fact-check providers. Each fact is a dict with 
+    'claim', 'truth_rating', 'source' and 'url'. All claims are embedded in one encode call
+    (skipped if the provider already has the similarities) and every entailment pair goes 
+    through the NLI model in one batch.
+    Returns the consensus classification and the supporting facts sorted by similarity.
+    use_cache=False makes the models recompute everything, see TextAnalysis.is_entailment_batch.
+    '''
+    if not facts:
+        return UNCLEAR, []
+
+    if sims is None:
+        # Embed the original claim along with all of the fact-checked claims at once
+        embs = text_analysis.embed([orig_claim] + [fact['claim'] for fact in facts], use_cache)
+        sims = text_analysis.embed_sims(embs[0], embs[1:])
+
+    # Only keep facts as supporting evidence if they pass the given threshold
+    matches = [(fact, float(sim)) for fact, sim in zip(facts, sims) if sim > threshold]
+
+    # First check if the user input and the verified fact entail one another
+    #  - if yes, then result entailment would mean not minsinfo
+    #  - if no, then result entailment would mean misinfo
+    claim_pairs = [(orig_claim, fact['claim'], 'claim') for fact, _ in matches]
+    result_pairs = [(fact['claim'], fact['truth_rating'], 'result') for fact, _ in matches]
+    entailments = text_analysis.is_entailment_batch(claim_pairs + result_pairs, use_cache=use_cache)
+    claim_entailments = entailments[:len(matches)]
+    result_entailments = entailments[len(matches):]
+
+    counts = Counter(MISINFO=0, NOT_MISINFO=0, UNCLEAR=0)
+    supporting_facts = []
+    for (fact, sim), claim_entailment, result_entailment in zip(matches, claim_entailments, result_entailments):
+        if claim_entailment:
+            category = MISINFO
+            if result_entailment:
+                category = NOT_MISINFO
+        else:
+            category = NOT_MISINFO
+            if result_entailment:
+                category = MISINFO
+
+        counts[category] += 1
+
+        supporting_facts.append({
+            "status": category,
+            "truth_rating": fact['truth_rating'],
+            "claim": fact['claim'],
+            "source": fact['source'],
+            "url": fact['url'],
+            "sim": sim,
+        })
+
+    supporting_facts.sort(key=lambda x: x['sim'], reverse=True)
+
+    if len(supporting_facts) == 0:
+        return UNCLEAR, []
+
+    # If one category has over 66%, then conclude that the class is correct. Otherwise say it is unclear
+    classification, count = counts.most_common(1)[0]
+    if count < len(supporting_facts) * 0.66:
+        classification = UNCLEAR
+
+    return classification, supporting_facts
+
+
+def merge_fact_checks(results):
+    '''
+    Combine the (classification, examples) results of several fact-check providers. Providers
+    that found nothing similar are ignored; the rest have to agree, otherwise it is unclear.
+    '''
+    conclusions = set()
+    examples = []
+    for classification, provider_examples in results:
+        if has_supporting_facts(provider_examples):
+            conclusions.add(classification)
+            examples.extend(provider_examples)
+
+    if not examples:
+        return UNCLEAR, [{"formatted_msg": NO_MATCHES_MSG}]
+
+    examples.sort(key=lambda x: x['sim'], reverse=True)
+    classification = conclusions.pop() if len(conclusions) == 1 else UNCLEAR
+    return classification, examples
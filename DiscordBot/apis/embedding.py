@@ -1,40 +1,147 @@
+import hashlib
 import re
 
+import numpy as np
 from numpy import dot
 from numpy.linalg import norm
-from sentence_transformers import SentenceTransformer
-from transformers import pipeline
 
-from apis.helper import MISINFO, NOT_MISINFO, UNCLEAR
+from apis.cache import TTLCache
+from apis.embeddingcache import get_embedding_cache, embedding_key
+from apis.helper import get_config, MISINFO, NOT_MISINFO, UNCLEAR
+from apis.inference import DEFAULT_EMBEDDING_MODEL
+from apis.models import get_model_registry, EMBEDDING_MODEL, ENTAILMENT_MODEL
+
+
+def create_text_analysis(threshold=0.8):
+    # With MODEL_SERVER_URL set the models live in a shared model server, see apis.modelserver
+    url = get_config().get('MODEL_SERVER_URL')
+    if url:
+        from apis.modelserver import RemoteTextAnalysis
+        return RemoteTextAnalysis(url, threshold, timeout=float(get_config().get('MODEL_SERVER_TIMEOUT', 30)))
+    return TextAnalysis(threshold)
+
+
+_ENTAILMENT_CACHE = None
+def get_entailment_cache():
+    # NLI labels for model inputs seen before, shared by every TextAnalysis in the process
+    global _ENTAILMENT_CACHE
+    if _ENTAILMENT_CACHE is None:
+        config = get_config()
+        ttl = config.get('ENTAILMENT_CACHE_TTL')
+        _ENTAILMENT_CACHE = TTLCache(max_size=int(config.get('ENTAILMENT_CACHE_SIZE', 50000)), ttl=float(ttl) if ttl else None)
+    return _ENTAILMENT_CACHE
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def entailment_key(premise, hypothesis):
+    # Not lowercased, the NLI model is case sensitive
+    pair = "\0".join(_WHITESPACE_RE.sub(" ", text).strip() for text in (premise, hypothesis))
+    return hashlib.sha256(pair.encode('utf-8')).hexdigest()
 
 
 class TextAnalysis:
-    def __init__(self, threshold=0.8):
+    is_remote = False
+    # Ratings decided by contradiction_re without a model call, counted across all instances
+    short_circuits = 0
+
+    def __init__(self, threshold=0.8, registry=None, embedding_cache=None, entailment_cache=None):
         self.contradiction_re = re.compile("(False|Inaccurate|Incorrect|Misleading|Misinformation)", re.I)
         self.threshold = threshold
 
-        self.emb_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-        self.entailment_model = pipeline(model="roberta-large-mnli")
+        # Models come from the shared registry so every provider uses the same weights
+        self.registry = registry or get_model_registry()
+        # Embeddings of texts seen before (e.g. fact check claims) are read back instead of recomputed
+        self.embedding_cache = embedding_cache if embedding_cache is not None else get_embedding_cache()
+        self.embedding_model_name = get_config().get('EMBEDDING_MODEL_NAME', DEFAULT_EMBEDDING_MODEL)
+        # The same claims and ratings come back constantly, their NLI labels are only computed once
+        self.entailment_cache = entailment_cache if entailment_cache is not None else get_entailment_cache()
         #self.sentiment_model = pipeline('sentiment-analysis')    
 
-    def embed(self, text):
+    @property
+    def emb_model(self):
+        return self.registry.get(EMBEDDING_MODEL)
+
+    @property
+    def entailment_model(self):
+        return self.registry.get(ENTAILMENT_MODEL)
+
+    def embed(self, text, use_cache=True):
         # text can either be a single sentence or multiple sentences
+        if self.embedding_cache is None or not use_cache:
+            return self._encode(text, use_cache)
+
+        texts = [text] if isinstance(text, str) else list(text)
+        keys = [embedding_key(self.embedding_model_name, t) for t in texts]
+        embs = self.embedding_cache.get_many(keys)
+        missing = [ind for ind, emb in enumerate(embs) if emb is None]
+        if missing:
+            # Only the misses go through the model, in one batch
+            computed = np.asarray(self._encode([texts[ind] for ind in missing]), dtype=np.float32)
+            self.embedding_cache.put_many([keys[ind] for ind in missing], computed)
+            for ind, emb in zip(missing, computed):
+                embs[ind] = emb
+        embs = np.stack(embs) if embs else np.zeros((0, 0), dtype=np.float32)
+        return embs[0] if isinstance(text, str) else embs
+
+    def _encode(self, text, use_cache=True):
+        # use_cache only matters to RemoteTextAnalysis, whose model server has its own cache
         return self.emb_model.encode(text)
 
     def embed_sim(self, emb1, emb2):
         cos_sim = dot(emb1, emb2) / (norm(emb1) * norm(emb2))
         return cos_sim
 
+    def embed_sims(self, emb, embs):
+        # Cosine similarity of one embedding against every row of a matrix in one go
+        return dot(embs, emb) / (norm(embs, axis=1) * norm(emb))
+
     def is_entailment(self, text1, text2, input_type='claim'):
-        combined = f"{text1.strip('.')}. {text2.strip('.')}."
-        result = self.entailment_model(combined)[0]
+        return self.is_entailment_batch([(text1, text2, input_type)])[0]
+
+    def is_entailment_batch(self, pairs, batch_size=16, use_cache=True):
+        '''
+        pairs is a list of (text1, text2, input_type) tuples. Ratings the contradiction regex already
+        decides and inputs with a cached label never reach the model; everything else goes through 
+        the NLI pipeline together instead of one forward pass per pair. With use_cache=False cached
+        labels are ignored, e.g. so a health probe really runs the model.
+        '''
+        results = [None] * len(pairs)
+        todo = {} # Map from cache keys to ((premise, hypothesis), indices of the pairs waiting on it)
+        for ind, (text1, text2, input_type) in enumerate(pairs):
+            if input_type == 'result' and self.contradiction_re.search(text2):
+                # False whatever the model says, see _to_entailment
+                TextAnalysis.short_circuits += 1
+                results[ind] = False
+                continue
+            key = entailment_key(text1, text2)
+            cached = self.entailment_cache.get(key) if use_cache else None
+            if cached is not None:
+                results[ind] = self._to_entailment(cached['label'], text2, input_type)
+            else:
+                todo.setdefault(key, ((text1, text2), []))[1].append(ind)
+
+        if todo:
+            for key, result in zip(todo, self._classify([pair for pair, _ in todo.values()], batch_size)):
+                self.entailment_cache.set(key, result)
+                for ind in todo[key][1]:
+                    _, text2, input_type = pairs[ind]
+                    results[ind] = self._to_entailment(result['label'], text2, input_type)
+        return results
+
+    def _classify(self, pairs, batch_size=16):
+        # The model sees each (premise, hypothesis) pair as two segments. Past the token limit only the
+        # premise is cut, so the fact check being compared is never lost; distilled models may use lowercase labels
+        inputs = [{"text": premise, "text_pair": hypothesis} for premise, hypothesis in pairs]
+        results = self.entailment_model(inputs, batch_size=batch_size, truncation="only_first")
+        return [{"label": result['label'].upper(), "score": float(result['score'])} for result in results]
 
+    def _to_entailment(self, label, text2, input_type):
         if input_type == 'claim':
-            if result['label'] == 'ENTAILMENT' or result['label'] == 'NEUTRAL':
+            if label == 'ENTAILMENT' or label == 'NEUTRAL':
                 return True
             return False
         if input_type == 'result':
-            if self.contradiction_re.search(text2) or result['label'] == 'CONTRADICTION' or result['label'] == 'NEUTRAL':
+            if self.contradiction_re.search(text2) or label == 'CONTRADICTION' or label == 'NEUTRAL':
                 return False
             return True
 
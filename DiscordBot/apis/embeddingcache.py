@@ -0,0 +1,202 @@
+import fcntl
+import hashlib
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from apis.helper import get_config
+
+
+# One index record: 64 bit text key, row in the vector file
+_RECORD = struct.Struct('<QI')
+# The ring cursor: how many rows have ever been written, the next one goes to cursor % capacity
+_CURSOR = struct.Struct('<Q')
+
+
+def embedding_key(model_name, text):
+    digest = hashlib.sha256(f"{model_name}\0{text.strip()}".encode('utf-8')).digest()
+    # 0 marks an empty row in the keys file
+    return int.from_bytes(digest[:8], 'little') or 1
+
+
+class EmbeddingCache:
+    '''
+    Persistent cache of text embeddings shared by every process on the machine. Vectors live in
+    a memory-mapped float32 .npy file and the key of each row in a parallel uint64 file, so
+    reads are zero-copy and survive restarts. An append-only offset index (key, row) lets each
+    process find rows other processes wrote by reading just the new records. Writers take a
+    file lock and fill the rows as a ring, overwriting the oldest once full. The ring cursor
+    is kept in its own file so compacting the index doesn't move it. A writer clears a row's
+    key before replacing the vector and sets it after; readers check the key before and after
+    copying, so a row that is being or has been overwritten is a miss.
+    '''
+
+    def __init__(self, path, capacity=100000):
+        self.path = path
+        self.capacity = capacity
+        self.vectors = None
+        self.keys = None
+        self.offsets = {} # Map from text keys to rows
+        self.row_keys = {} # Map from rows to the text key the index last put there
+        self.index_pos = 0
+        self.index_inode = None
+        self.records = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.path + ".lock", 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _open(self, dim=None):
+        # The files are created by the first writer, readers wait for them to exist
+        if self.vectors is not None:
+            return True
+        vectors_path, keys_path = self.path + ".npy", self.path + ".keys.npy"
+        if not os.path.exists(keys_path):
+            if dim is None:
+                return False
+            np.lib.format.open_memmap(vectors_path, mode='w+', dtype=np.float32, shape=(self.capacity, dim)).flush()
+            open(self.path + ".idx", 'wb').close()
+            # Written last, its existence means the other files are complete
+            np.lib.format.open_memmap(keys_path, mode='w+', dtype=np.uint64, shape=(self.capacity,)).flush()
+        self.vectors = np.load(vectors_path, mmap_mode='r+')
+        self.keys = np.load(keys_path, mmap_mode='r+')
+        self.capacity = self.vectors.shape[0]
+        return True
+
+    def _read_cursor(self):
+        try:
+            with open(self.path + ".cursor", 'rb') as f:
+                data = f.read(_CURSOR.size)
+        except FileNotFoundError:
+            return 0
+        return _CURSOR.unpack(data)[0] if len(data) == _CURSOR.size else 0
+
+    def _write_cursor(self, cursor):
+        # Replaced in one step so a crash never leaves a torn cursor behind
+        tmp_path = self.path + ".cursor.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_CURSOR.pack(cursor))
+        os.replace(tmp_path, self.path + ".cursor")
+
+    def _catch_up(self):
+        # Reads index records written since the last call, by this or any other process
+        index_path = self.path + ".idx"
+        stat = os.stat(index_path)
+        if stat.st_ino != self.index_inode or stat.st_size < self.index_pos:
+            # Compacted by another process, start over
+            self.offsets, self.row_keys, self.index_pos, self.records = {}, {}, 0, 0
+            self.index_inode = stat.st_ino
+        if stat.st_size - self.index_pos < _RECORD.size:
+            return
+        with open(index_path, 'rb') as f:
+            f.seek(self.index_pos)
+            data = f.read(stat.st_size - self.index_pos)
+        usable = len(data) - len(data) % _RECORD.size
+        for key, row in _RECORD.iter_unpack(data[:usable]):
+            old = self.row_keys.get(row)
+            if old is not None and self.offsets.get(old) == row:
+                del self.offsets[old]
+            self.row_keys[row] = key
+            self.offsets[key] = row
+        self.index_pos += usable
+        self.records += usable // _RECORD.size
+
+    def get_many(self, keys):
+        # A list with the cached embedding for each key, or None
+        with self.lock:
+            if not self._open():
+                self.misses += len(keys)
+                return [None] * len(keys)
+            if any(key not in self.offsets for key in keys):
+                self._catch_up()
+            found = []
+            for key in keys:
+                row = self.offsets.get(key)
+                vector = None
+                if row is not None and int(self.keys[row]) == key:
+                    vector = np.array(self.vectors[row])
+                    if int(self.keys[row]) != key:
+                        # Overwritten by another process while we were copying
+                        vector = None
+                found.append(vector)
+            hits = sum(vector is not None for vector in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            return found
+
+    def put_many(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(keys):
+            return
+        with self.lock, self._file_lock():
+            self._open(vectors.shape[-1])
+            if vectors.shape[-1] != self.vectors.shape[-1]:
+                # Another embedding model, its vectors are just not cached
+                if not self.skipped:
+                    print(f"Embedding cache {self.path} holds {self.vectors.shape[-1]} dimensional vectors, not caching {vectors.shape[-1]} dimensional ones")
+                self.skipped += len(keys)
+                return
+            self._catch_up()
+            cursor = self._read_cursor()
+            records = []
+            for key, vector in zip(keys, vectors):
+                if key in self.offsets:
+                    continue
+                row = (cursor + len(records)) % self.capacity
+                self.keys[row] = 0
+                self.vectors[row] = vector
+                self.keys[row] = key
+                records.append(_RECORD.pack(key, row))
+            if not records:
+                return
+            # Vectors go to disk before the index points at them
+            self.vectors.flush()
+            self.keys.flush()
+            with open(self.path + ".idx", 'ab') as f:
+                f.write(b"".join(records))
+            self._write_cursor(cursor + len(records))
+            self._catch_up()
+            if self.records > 4 * self.capacity:
+                self._compact()
+
+    def _compact(self):
+        # Rewrites the index with one record per live row
+        live = sorted(self.row_keys.items())
+        tmp_path = self.path + ".idx.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(b"".join(_RECORD.pack(key, row) for row, key in live if self.offsets.get(key) == row))
+        os.replace(tmp_path, self.path + ".idx")
+        self.index_inode = None
+        self._catch_up()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self), "hits": self.hits, "misses": self.misses, "skipped": self.skipped, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+_CACHE = None
+def get_embedding_cache():
+    # None unless EMBEDDING_CACHE_PATH is configured
+    global _CACHE
+    if _CACHE is None:
+        config = get_config()
+        path = config.get('EMBEDDING_CACHE_PATH')
+        if not path:
+            return None
+        _CACHE = EmbeddingCache(path, capacity=int(config.get('EMBEDDING_CACHE_SIZE', 100000)))
+    return _CACHE
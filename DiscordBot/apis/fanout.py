@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+from apis.breaker import CircuitOpenError
+
+
+class FanOut:
+    '''
+    Runs every registered provider at the same time, each with its own deadline. Providers are
+    async callables that all take the same arguments. Whatever finished in time is returned;
+    providers that raised, ran past their deadline or have an open circuit breaker are reported 
+    as failed instead. A provider registered as the fallback of another one waits for it and is
+    only called (and only counted by its breaker) when that provider's answer isn't enough.
+    '''
+
+    def __init__(self, default_timeout=15.0):
+        self.default_timeout = default_timeout
+        self.providers = {}
+        self.breakers = {}
+        self.latencies = {}
+        self.fallbacks = {} # Map from fallback providers to (primary provider, check whether its result is enough)
+        self.skipped = {} # Map from fallback providers to how often the primary's result made them unnecessary
+
+    def register(self, name, fn, timeout=None, breaker=None, probe_input=None, probe_kwargs=None, fallback_for=None, sufficient=None):
+        timeout = timeout or self.default_timeout
+        self.providers[name] = (fn, timeout)
+        if fallback_for is not None:
+            self.fallbacks[name] = (fallback_for, sufficient)
+            self.skipped[name] = 0
+        if breaker is not None:
+            if probe_input is not None:
+                # probe_kwargs e.g. turn off caches, so the probe can't pass without the provider doing any work
+                breaker.probe = lambda: asyncio.wait_for(fn(probe_input, **(probe_kwargs or {})), timeout)
+            self.breakers[name] = breaker
+
+    async def _call(self, name, *args):
+        fn, timeout = self.providers[name]
+        breaker = self.breakers.get(name)
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(f"circuit breaker is {breaker.state}")
+
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = await asyncio.wait_for(fn(*args), timeout)
+            ok = True
+            return result
+        finally:
+            self.latencies[name] = time.perf_counter() - start
+            if breaker is not None:
+                breaker.record(ok, self.latencies[name])
+
+    async def _outcome(self, name, *args):
+        try:
+            return name, await self._call(name, *args), True
+        except CircuitOpenError:
+            pass
+        except asyncio.TimeoutError:
+            print(f"Provider {name} missed its {self.providers[name][1]}s deadline")
+        except Exception as e:
+            print(f"Provider {name} failed: {e}")
+        return name, None, False
+
+    async def _fallback_outcome(self, name, primary, *args):
+        # ok is None when the primary already answered well enough and the fallback wasn't called
+        _, sufficient = self.fallbacks[name]
+        _, result, ok = await primary
+        if ok and sufficient(result):
+            self.skipped[name] += 1
+            return name, None, None
+        return await self._outcome(name, *args)
+
+    async def run(self, *args, on_result=None):
+        '''
+        Returns (results, failed). If given, on_result(results, failed, pending) is awaited every 
+        time a provider finishes, so callers can show partial results while the rest still run.
+        Fallbacks that weren't needed are in neither.
+        '''
+        tasks = {name: asyncio.ensure_future(self._outcome(name, *args)) for name in self.providers if name not in self.fallbacks}
+        for name, (primary, _) in self.fallbacks.items():
+            if primary in tasks:
+                tasks[name] = asyncio.ensure_future(self._fallback_outcome(name, tasks[primary], *args))
+            else:
+                # The primary isn't enabled, the fallback is always needed
+                tasks[name] = asyncio.ensure_future(self._outcome(name, *args))
+
+        pending = set(self.providers)
+        results = {}
+        failed = []
+        try:
+            for outcome in asyncio.as_completed(list(tasks.values())):
+                name, result, ok = await outcome
+                pending.discard(name)
+                if ok:
+                    results[name] = result
+                elif ok is not None:
+                    failed.append(name)
+                if on_result is not None:
+                    await on_result(results, failed, pending)
+        finally:
+            # Only left running if on_result raised or the caller was cancelled
+            for task in tasks.values():
+                task.cancel()
+        return results, failed
@@ -1,4 +1,7 @@
+import asyncio
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import dotenv_values, find_dotenv
 
@@ -15,3 +18,43 @@ def get_config():
 MISINFO = "Misinformation"
 NOT_MISINFO = "Not-misinformation"
 UNCLEAR = "Unclear"
+# Used in place of a result when the provider was skipped or didn't answer in time
+UNAVAILABLE = "Unavailable"
+# Used in place of a result while the provider is still running
+WAITING = "Waiting"
+
+
+def get_provider_timeout(name):
+    # The fan-out deadline of a provider, its HTTP calls have to fit in it
+    config = get_config()
+    return float(config.get(f'{name.upper()}_TIMEOUT', config.get('PROVIDER_TIMEOUT', 15)))
+
+def get_http_budget(name):
+    # Share of the provider deadline its HTTP requests and retries may use, the rest is left for parsing
+    return get_provider_timeout(name) * float(get_config().get('HTTP_DEADLINE_SHARE', 0.7))
+
+
+# Model inference is CPU bound, so it runs on a small dedicated thread pool instead of
+# the event loop. The semaphore bounds how many jobs can be waiting on the pool at once.
+_EXECUTOR = None
+_EXECUTOR_SLOTS = None
+def get_executor():
+    global _EXECUTOR, _EXECUTOR_SLOTS
+    if not _EXECUTOR:
+        config = get_config()
+        max_workers = int(config.get('MODEL_WORKERS', 2))
+        max_queued = int(config.get('MODEL_QUEUE_SIZE', max_workers * 4))
+        _EXECUTOR = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='model')
+        _EXECUTOR_SLOTS = asyncio.Semaphore(max_queued)
+    return _EXECUTOR
+
+async def run_blocking(fn, *args, **kwargs):
+    executor = get_executor()
+    async with _EXECUTOR_SLOTS:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+async def run_io(fn, *args, **kwargs):
+    # Blocking disk access, e.g. SQLite, goes to the default pool so it never waits behind model inference
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
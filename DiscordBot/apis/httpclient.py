@@ -0,0 +1,79 @@
+import asyncio
+import random
+
+import aiohttp
+
+from apis.helper import get_config
+
+
+class HttpClient:
+    '''
+    Shared aiohttp session for every outbound API call. Connections are pooled and kept alive
+    between calls, every request has a timeout, and transient failures (connection errors, 
+    timeouts, 429 and 5xx responses) are retried with jittered exponential backoff. A budget
+    caps all attempts and backoff together, so retries stop before the caller's deadline
+    instead of being cut off by it.
+    '''
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, default_timeout=10.0, retries=2, backoff=0.5, limit=32, limit_per_host=8, keepalive_timeout=60):
+        self.default_timeout = default_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+
+    def get_session(self):
+        # The session has to be created from inside the running event loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, keepalive_timeout=self.keepalive_timeout)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def get_json(self, url, params=None, headers=None, timeout=None, retries=None, budget=None):
+        timeout = timeout or self.default_timeout
+        retries = self.retries if retries is None else retries
+        loop = asyncio.get_running_loop()
+        deadline = None if budget is None else loop.time() + budget
+
+        def can_retry(attempt, delay):
+            # Only if the backoff still leaves time for another attempt
+            return attempt < retries and (deadline is None or loop.time() + delay < deadline)
+
+        for attempt in range(retries + 1):
+            # Full jitter so clients that failed together don't retry together
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            attempt_timeout = timeout if deadline is None else min(timeout, deadline - loop.time())
+            try:
+                async with self.get_session().get(url, params=params, headers=headers, timeout=aiohttp.ClientTimeout(total=attempt_timeout)) as response:
+                    if response.status in self.RETRY_STATUSES and can_retry(attempt, delay):
+                        print(f"GET {url} returned {response.status}, retrying")
+                    else:
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if not can_retry(attempt, delay):
+                    raise
+                print(f"GET {url} failed ({e!r}), retrying")
+
+            await asyncio.sleep(delay)
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+
+_HTTP_CLIENT = None
+def get_http_client():
+    global _HTTP_CLIENT
+    if not _HTTP_CLIENT:
+        config = get_config()
+        _HTTP_CLIENT = HttpClient(
+            default_timeout=float(config.get('HTTP_TIMEOUT', 10)),
+            retries=int(config.get('HTTP_RETRIES', 2)),
+            backoff=float(config.get('HTTP_BACKOFF', 0.5)),
+        )
+    return _HTTP_CLIENT
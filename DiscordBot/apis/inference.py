@@ -0,0 +1,194 @@
+import os
+import sys
+
+import numpy as np
+
+from apis.helper import get_config
+
+
+# The default models, the NLI one can be swapped for a distilled model with NLI_MODEL
+DEFAULT_EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+DEFAULT_NLI_MODEL = 'roberta-large-mnli'
+
+TORCH_BACKEND = "torch"
+ONNX_BACKEND = "onnx"
+QUANTIZED_FILE = "model_quantized.onnx"
+# Token limit on the ONNX backend unless MODEL_MAX_SEQ_LENGTH is set, PyTorch keeps each model's own
+ONNX_MAX_LENGTH = 256
+
+# Pairs used to compare a backend's NLI labels against the reference PyTorch model
+PARITY_PAIRS = [
+    ("The earth is round", "The earth is flat"),
+    ("Vaccines cause autism", "There is no link between vaccines and autism"),
+    ("The moon landing happened in 1969", "Apollo 11 landed on the moon in 1969"),
+    ("Drinking bleach cures covid", "False: drinking bleach does not cure covid and is dangerous"),
+    ("The president was born in Kenya", "Misleading claim about the president's birthplace"),
+    ("Coffee is a popular drink", "Many people drink coffee every day"),
+    ("The election was stolen", "Courts found no evidence of widespread fraud in the election"),
+    ("Water boils at 100 degrees celsius at sea level", "At sea level, water boils at 100 degrees celsius"),
+]
+
+
+def get_backend_config():
+    config = get_config()
+    return {
+        "backend": config.get('MODEL_BACKEND', TORCH_BACKEND).lower(),
+        "threads": int(config.get('MODEL_THREADS', 0)) or None,
+        "max_length": int(config['MODEL_MAX_SEQ_LENGTH']) if config.get('MODEL_MAX_SEQ_LENGTH') else None,
+        "onnx_dir": config.get('ONNX_MODEL_DIR', 'onnx_models'),
+        "quantize": config.get('ONNX_QUANTIZE', 'true').lower() == 'true',
+    }
+
+
+def _import_optimum():
+    try:
+        import onnxruntime
+        from optimum import onnxruntime as ort
+    except ImportError:
+        raise Exception("MODEL_BACKEND=onnx needs the optional onnx packages, pip install optimum[onnxruntime]")
+    return onnxruntime, ort
+
+
+def _session_options(threads):
+    onnxruntime, _ = _import_optimum()
+    options = onnxruntime.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
+
+
+def export_onnx(model_name, ort_class, quantize=True, onnx_dir='onnx_models'):
+    '''
+    Exports a Hugging Face model to ONNX once and, if asked, quantizes its weights to int8 with
+    dynamic quantization. Returns the directory and the file to load; later calls reuse the export.
+    '''
+    _, ort = _import_optimum()
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    save_dir = os.path.join(onnx_dir, model_name.replace('/', '__'))
+    file_name = QUANTIZED_FILE if quantize else "model.onnx"
+    if os.path.exists(os.path.join(save_dir, file_name)):
+        return save_dir, file_name
+
+    model = getattr(ort, ort_class).from_pretrained(model_name, export=True)
+    model.save_pretrained(save_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(save_dir)
+    if quantize:
+        # avx2 kernels run on any x86 host from the last decade, arm64 on Graviton and Apple silicon
+        is_arm = os.uname().machine in ("aarch64", "arm64")
+        qconfig = (AutoQuantizationConfig.arm64 if is_arm else AutoQuantizationConfig.avx2)(is_static=False, per_channel=False)
+        quantizer = ort.ORTQuantizer.from_pretrained(model)
+        quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+    print(f"Exported {model_name} to {os.path.join(save_dir, file_name)}")
+    return save_dir, file_name
+
+
+class OnnxSentenceEncoder:
+    '''
+    ONNX replacement for SentenceTransformer.encode: mean pooling over the token embeddings,
+    then L2 normalization, same as the all-MiniLM-L6-v2 pipeline.
+    '''
+
+    def __init__(self, model_name, threads=None, max_length=ONNX_MAX_LENGTH, quantize=True, onnx_dir='onnx_models', batch_size=32):
+        _, ort = _import_optimum()
+        from transformers import AutoTokenizer
+
+        save_dir, file_name = export_onnx(model_name, "ORTModelForFeatureExtraction", quantize, onnx_dir)
+        self.model = ort.ORTModelForFeatureExtraction.from_pretrained(save_dir, file_name=file_name, session_options=_session_options(threads))
+        self.tokenizer = AutoTokenizer.from_pretrained(save_dir)
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.nbytes = os.path.getsize(os.path.join(save_dir, file_name))
+
+    def encode(self, text):
+        texts = [text] if isinstance(text, str) else list(text)
+        embs = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(texts[start:start + self.batch_size], padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="np")
+            hidden = np.asarray(self.model(**inputs).last_hidden_state)
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            embs.append(pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12))
+        embs = np.concatenate(embs).astype(np.float32) if embs else np.zeros((0, 0), dtype=np.float32)
+        return embs[0] if isinstance(text, str) else embs
+
+
+def load_embedding_model(model_name=None):
+    settings = get_backend_config()
+    model_name = model_name or get_config().get('EMBEDDING_MODEL_NAME', DEFAULT_EMBEDDING_MODEL)
+    if settings["backend"] == ONNX_BACKEND:
+        return OnnxSentenceEncoder(model_name, settings["threads"], settings["max_length"] or ONNX_MAX_LENGTH, settings["quantize"], settings["onnx_dir"])
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if settings["threads"]:
+        torch.set_num_threads(settings["threads"])
+    model = SentenceTransformer(model_name, device='cpu')
+    if settings["max_length"]:
+        model.max_seq_length = settings["max_length"]
+    return model
+
+
+def load_nli_model(model_name=None, backend=None):
+    '''
+    A text-classification pipeline for the NLI model. The ONNX backend runs the same pipeline on
+    onnxruntime, so callers see the same labels either way.
+    '''
+    settings = get_backend_config()
+    backend = backend or settings["backend"]
+    model_name = model_name or get_config().get('NLI_MODEL', DEFAULT_NLI_MODEL)
+    from transformers import AutoTokenizer, pipeline
+
+    if backend == ONNX_BACKEND:
+        _, ort = _import_optimum()
+        save_dir, file_name = export_onnx(model_name, "ORTModelForSequenceClassification", settings["quantize"], settings["onnx_dir"])
+        model = ort.ORTModelForSequenceClassification.from_pretrained(save_dir, file_name=file_name, session_options=_session_options(settings["threads"]))
+        tokenizer = AutoTokenizer.from_pretrained(save_dir)
+        nli = pipeline("text-classification", model=model, tokenizer=tokenizer)
+        nli.nbytes = os.path.getsize(os.path.join(save_dir, file_name))
+    else:
+        import torch
+        if settings["threads"]:
+            torch.set_num_threads(settings["threads"])
+        nli = pipeline("text-classification", model=model_name, device=-1)
+
+    # Longer premises are truncated to this, see TextAnalysis._classify
+    max_length = settings["max_length"] or (ONNX_MAX_LENGTH if backend == ONNX_BACKEND else None)
+    if max_length:
+        nli.tokenizer.model_max_length = max_length
+    return nli
+
+
+def check_parity(reference, candidate, pairs=PARITY_PAIRS):
+    '''
+    Fraction of pairs where both NLI pipelines predict the same label, plus the disagreements.
+    '''
+    inputs = [{"text": text1, "text_pair": text2} for text1, text2 in pairs]
+    expected = [result['label'].upper() for result in reference(inputs, truncation="only_first")]
+    actual = [result['label'].upper() for result in candidate(inputs, truncation="only_first")]
+    mismatches = [(pair, want, got) for pair, want, got in zip(pairs, expected, actual) if want != got]
+    return 1 - len(mismatches) / len(pairs), mismatches
+
+
+if __name__ == "__main__":
+    # Exports the configured models and compares the candidate backend against PyTorch, e.g.
+    # MODEL_BACKEND=onnx NLI_MODEL=cross-encoder/nli-distilroberta-base python -m apis.inference
+    import time
+
+    candidate = load_nli_model()
+    reference = load_nli_model(DEFAULT_NLI_MODEL, backend=TORCH_BACKEND)
+    agreement, mismatches = check_parity(reference, candidate)
+    print(f"Label agreement with {DEFAULT_NLI_MODEL} on PyTorch: {agreement:.0%}")
+    for (text1, text2), want, got in mismatches:
+        print(f"  {text1!r} / {text2!r}: expected {want}, got {got}")
+
+    inputs = [{"text": text1, "text_pair": text2} for text1, text2 in PARITY_PAIRS] * 8
+    for name, nli in [("reference", reference), ("candidate", candidate)]:
+        start = time.perf_counter()
+        nli(inputs, batch_size=16, truncation="only_first")
+        print(f"{name}: {len(inputs) / (time.perf_counter() - start):.1f} pairs/s")
+    sys.exit(0 if not mismatches else 1)
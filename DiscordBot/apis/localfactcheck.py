@@ -0,0 +1,167 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from apis.helper import get_config, run_blocking, UNCLEAR
+from apis.consensus import classify_facts, NO_MATCHES_MSG
+from apis.embedding import create_text_analysis
+
+
+def _parse_claimreviews(data):
+    '''
+    Pull (claim, truth_rating, source, url) facts out of a ClaimReview export. Accepts the
+    schema.org DataFeed export, a plain list of ClaimReview objects, or a saved response 
+    from the Google Fact Check claims:search endpoint.
+    '''
+    facts = []
+    if isinstance(data, list):
+        for item in data:
+            facts.extend(_parse_claimreviews(item))
+        return facts
+    if not isinstance(data, dict):
+        return facts
+
+    if 'dataFeedElement' in data:
+        for element in data['dataFeedElement']:
+            facts.extend(_parse_claimreviews(element.get('item', [])))
+
+    elif 'claims' in data:
+        for claim in data['claims']:
+            if not claim.get('claimReview') or not claim.get('text'):
+                continue
+            review = claim['claimReview'][0]
+            facts.append({
+                "claim": claim['text'],
+                "truth_rating": review.get('textualRating', ''),
+                "source": review.get('publisher', {}).get('site', ''),
+                "url": review.get('url', ''),
+            })
+
+    elif data.get('@type') == 'ClaimReview' and data.get('claimReviewed'):
+        rating = data.get('reviewRating', {})
+        author = data.get('author', {})
+        if isinstance(author, list):
+            author = author[0] if author else {}
+        facts.append({
+            "claim": data['claimReviewed'],
+            "truth_rating": rating.get('alternateName', ''),
+            "source": author.get('name') or author.get('url', ''),
+            "url": data.get('url', ''),
+        })
+
+    return facts
+
+
+class LocalFactCheck:
+    '''
+    Offline fact-check store bulk loaded from ClaimReview JSON exports. Every claim is embedded 
+    once into a normalized matrix (cached on disk), so a lookup is a single matrix-vector product.
+    '''
+
+    def __init__(self, paths=None, cache_path=None, defer_load=False):
+        config = get_config()
+        if paths is None:
+            paths = [path.strip() for path in config.get('LOCAL_FACTCHECK_PATHS', '').split(',') if path.strip()]
+        self.paths = paths
+        self.cache_path = cache_path or config.get('LOCAL_FACTCHECK_CACHE')
+        if self.cache_path and not self.cache_path.endswith(".npy"):
+            # np.save adds the suffix itself, so the path we check has to have it too
+            self.cache_path += ".npy"
+        self.text_analysis = create_text_analysis()
+
+        self.facts = []
+        self.embeddings = None
+        self.lock = threading.Lock()
+        if not defer_load:
+            self.load_all()
+
+    def load_all(self):
+        # With defer_load the exports are read later, e.g. in the background after startup
+        for pattern in self.paths:
+            for path in sorted(glob.glob(pattern)):
+                self.load(path)
+
+    def load(self, path):
+        with open(path) as f:
+            facts = _parse_claimreviews(json.load(f))
+
+        # Skip reviews that have already been loaded from another export
+        seen = {(fact['claim'], fact['url']) for fact in self.facts}
+        for fact in facts:
+            if (fact['claim'], fact['url']) not in seen:
+                seen.add((fact['claim'], fact['url']))
+                self.facts.append(fact)
+        self.embeddings = None
+        print(f"Loaded {len(facts)} fact checks from {path} ({len(self.facts)} total)")
+
+    def __len__(self):
+        return len(self.facts)
+
+    def _fingerprint(self):
+        # Vectors from another embedding model can't be reused, even for the same claims
+        digest = hashlib.sha256(self.text_analysis.embedding_model_name.encode('utf-8') + b"\0")
+        for fact in self.facts:
+            digest.update(fact['claim'].encode('utf-8') + b"\0")
+        return digest.hexdigest()
+
+    def warm_up(self):
+        # Builds (or maps the cached) claim embeddings ahead of the first lookup
+        if self.facts:
+            self._get_embeddings()
+
+    def _get_embeddings(self):
+        # Built on first use since it needs the embedding model
+        if self.embeddings is None:
+            with self.lock:
+                if self.embeddings is None:
+                    self.embeddings = self._build_embeddings()
+        return self.embeddings
+
+    def _build_embeddings(self):
+        fingerprint = self._fingerprint()
+        if self.cache_path and os.path.exists(self.cache_path) and os.path.exists(self.cache_path + ".sha256"):
+            with open(self.cache_path + ".sha256") as f:
+                if f.read().strip() == fingerprint:
+                    return np.load(self.cache_path, mmap_mode='r')
+
+        embs = np.asarray(self.text_analysis.embed([fact['claim'] for fact in self.facts]), dtype=np.float32)
+        embs /= np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+        if self.cache_path:
+            np.save(self.cache_path, embs)
+            with open(self.cache_path + ".sha256", 'w') as f:
+                f.write(fingerprint)
+        return embs
+
+    def nearest(self, emb, k=10):
+        # Returns the indices and cosine similarities of the k most similar stored claims
+        embs = self._get_embeddings()
+        query = emb / max(np.linalg.norm(emb), 1e-12)
+        sims = embs @ query.astype(np.float32)
+        k = min(k, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return top, sims[top]
+
+    async def get_matching_facts(self, claim, threshold=0.75, k=10, use_cache=True):
+        classification_result, examples = await run_blocking(self._get_matching_facts, claim, threshold, k, use_cache)
+        return classification_result, examples
+
+    def _get_matching_facts(self, claim, threshold, k, use_cache):
+        if not self.facts:
+            return UNCLEAR, [{"formatted_msg": NO_MATCHES_MSG}]
+        top, sims = self.nearest(self.text_analysis.embed(claim, use_cache), k)
+        return self._parse_get_matching_facts(claim, [self.facts[i] for i in top], sims, threshold, use_cache)
+
+    def _parse_get_matching_facts(self, orig_claim, facts, sims, threshold, use_cache=True):
+        classification, supporting_facts = classify_facts(self.text_analysis, orig_claim, facts, threshold, sims=sims, use_cache=use_cache)
+        if len(supporting_facts) == 0:
+            return UNCLEAR, [{"formatted_msg": NO_MATCHES_MSG}]
+
+        for fact in supporting_facts:
+            fact["formatted_msg"] = f"Sim to current post: {fact['sim']}, Conclusion: {fact['status']}, URL supporting conlusion: {fact['url']}, Site that Fact Checked: {fact['source']}"
+
+        return classification, supporting_facts
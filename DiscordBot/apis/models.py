@@ -0,0 +1,95 @@
+import threading
+import time
+
+from apis.helper import get_config
+
+
+# Names used to look models up in the registry (and in the ENABLED_MODELS config value)
+EMBEDDING_MODEL = "embedding"
+ENTAILMENT_MODEL = "entailment"
+
+
+# The heavy imports live inside the loaders so nothing is pulled in until a model is needed.
+# MODEL_BACKEND picks PyTorch or int8 ONNX, see apis.inference
+def _load_embedding_model():
+    from apis.inference import load_embedding_model
+    return load_embedding_model()
+
+def _load_entailment_model():
+    from apis.inference import load_nli_model, check_parity, DEFAULT_NLI_MODEL, TORCH_BACKEND
+    nli = load_nli_model()
+    if get_config().get('MODEL_PARITY_CHECK', 'false').lower() == 'true':
+        # Loads the reference model once to compare labels, only meant for trying out a backend
+        agreement, mismatches = check_parity(load_nli_model(DEFAULT_NLI_MODEL, backend=TORCH_BACKEND), nli)
+        print(f"NLI label agreement with {DEFAULT_NLI_MODEL}: {agreement:.0%} ({len(mismatches)} mismatches)")
+    return nli
+
+
+def _model_nbytes(model):
+    # ONNX models report the size of their weights file
+    if hasattr(model, 'nbytes'):
+        return model.nbytes
+    # Pipelines wrap the underlying torch module, SentenceTransformers are one
+    module = getattr(model, 'model', model)
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelRegistry:
+    '''
+    Holds a single copy of each model for the whole process. Models are loaded the first 
+    time they are asked for, so providers can share them without paying for them up front.
+    '''
+
+    LOADERS = {
+        EMBEDDING_MODEL: _load_embedding_model,
+        ENTAILMENT_MODEL: _load_entailment_model,
+    }
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = self.LOADERS.keys()
+        self.enabled = set(enabled)
+        self.models = {}
+        self.memory = {}
+        self.lock = threading.Lock()
+
+    def is_enabled(self, name):
+        return name in self.enabled
+
+    def is_loaded(self, name):
+        return name in self.models
+
+    def get(self, name):
+        if name not in self.LOADERS:
+            raise Exception(f"Unknown model {name}")
+        if not self.is_enabled(name):
+            raise Exception(f"Model {name} is disabled, add it to ENABLED_MODELS to use it")
+
+        # Inference runs on executor threads, so only let one of them do the load
+        if name not in self.models:
+            with self.lock:
+                if name not in self.models:
+                    start = time.perf_counter()
+                    model = self.LOADERS[name]()
+                    self.memory[name] = _model_nbytes(model)
+                    self.models[name] = model
+                    print(f"Loaded {name} model in {time.perf_counter() - start:.1f}s ({self.memory[name] / 2**20:.1f} MB)")
+        return self.models[name]
+
+    def memory_usage(self):
+        # Bytes of weights and buffers held by each loaded model
+        return dict(self.memory)
+
+
+_REGISTRY = None
+def get_model_registry():
+    global _REGISTRY
+    if not _REGISTRY:
+        enabled = get_config().get('ENABLED_MODELS')
+        if enabled is not None:
+            enabled = [name.strip() for name in enabled.split(',') if name.strip()]
+        _REGISTRY = ModelRegistry(enabled)
+    return _REGISTRY
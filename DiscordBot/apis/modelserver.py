@@ -0,0 +1,156 @@
+import asyncio
+import base64
+import http.client
+import json
+import os
+import socket
+import threading
+from urllib.parse import urlparse
+
+import numpy as np
+from aiohttp import web
+
+from apis.batcher import MicroBatcher
+from apis.embedding import TextAnalysis
+from apis.helper import get_config, run_blocking
+
+
+def _encode_array(array):
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode('ascii')}
+
+def _decode_array(payload):
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32).reshape(payload["shape"])
+
+
+class ModelServer:
+    '''
+    Hosts the TextAnalysis models once for every bot process on the machine. Requests from all
+    clients go through one MicroBatcher per model, so texts sent by different bots at about the
+    same time share a forward pass. Serves over a Unix socket or localhost HTTP.
+    '''
+
+    def __init__(self, text_analysis=None, max_batch_size=32, max_delay=0.005):
+        self.text_analysis = text_analysis or TextAnalysis()
+        self.embed_batcher = MicroBatcher(self._embed_batch, max_batch_size, max_delay)
+        self.entailment_batcher = MicroBatcher(self._entailment_batch, max_batch_size, max_delay)
+
+    async def _embed_batch(self, texts):
+        return list(await run_blocking(self.text_analysis.embed, texts))
+
+    async def _entailment_batch(self, pairs):
+        return await run_blocking(self.text_analysis._classify, pairs, len(pairs))
+
+    async def handle_embed(self, request):
+        payload = await request.json()
+        texts = payload["texts"]
+        if not payload.get("use_cache", True):
+            # A health probe, it skips the batcher and the server's embedding cache so the model really runs
+            embs = list(await run_blocking(self.text_analysis.embed, texts, False))
+        else:
+            embs = await asyncio.gather(*[self.embed_batcher.submit(text) for text in texts])
+        return web.json_response({"embeddings": _encode_array(np.stack(embs) if embs else np.zeros((0, 0)))})
+
+    async def handle_entailment(self, request):
+        pairs = (await request.json())["pairs"]
+        results = await asyncio.gather(*[self.entailment_batcher.submit(tuple(pair)) for pair in pairs])
+        return web.json_response({"results": results})
+
+    async def handle_stats(self, request):
+        registry = self.text_analysis.registry
+        return web.json_response({
+            "embed": self.embed_batcher.stats(),
+            "entailment": self.entailment_batcher.stats(),
+            "memory": registry.memory_usage(),
+        })
+
+    def app(self):
+        app = web.Application(client_max_size=16 * 2**20)
+        app.router.add_post("/embed", self.handle_embed)
+        app.router.add_post("/entailment", self.handle_entailment)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+    def serve(self, url):
+        # Load everything before accepting requests so the first clients don't time out
+        self.text_analysis.embed("warm up")
+        self.text_analysis.is_entailment("warm up", "warm up")
+
+        parsed = urlparse(url)
+        if parsed.scheme == "unix":
+            if os.path.exists(parsed.path):
+                os.remove(parsed.path)
+            web.run_app(self.app(), path=parsed.path)
+        else:
+            web.run_app(self.app(), host=parsed.hostname or "127.0.0.1", port=parsed.port or 8765)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class RemoteTextAnalysis(TextAnalysis):
+    '''
+    Drop-in TextAnalysis that sends embedding and NLI inference to a ModelServer instead of loading
+    the models in this process. Calls are blocking like the local ones and already run on the
+    model executor, so each executor thread keeps its own keep-alive connection.
+    '''
+
+    is_remote = True
+
+    def __init__(self, url, threshold=0.8, timeout=30.0):
+        super().__init__(threshold)
+        self.url = urlparse(url)
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connection(self):
+        if getattr(self.local, "conn", None) is None:
+            if self.url.scheme == "unix":
+                self.local.conn = _UnixHTTPConnection(self.url.path, self.timeout)
+            else:
+                self.local.conn = http.client.HTTPConnection(self.url.hostname, self.url.port or 8765, timeout=self.timeout)
+        return self.local.conn
+
+    def _post(self, path, payload):
+        body = json.dumps(payload)
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request("POST", path, body, {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                data = response.read()
+                if response.status != 200:
+                    raise Exception(f"Model server returned {response.status} for {path}")
+                return json.loads(data)
+            except (ConnectionError, http.client.HTTPException):
+                # The server closed an idle keep-alive connection, reconnect once
+                conn.close()
+                self.local.conn = None
+                if attempt:
+                    raise
+
+    def _encode(self, text, use_cache=True):
+        texts = [text] if isinstance(text, str) else list(text)
+        embs = _decode_array(self._post("/embed", {"texts": texts, "use_cache": use_cache})["embeddings"])
+        return embs[0] if isinstance(text, str) else embs
+
+    def _classify(self, pairs, batch_size=16):
+        # Only pairs that missed the local entailment cache get here
+        return self._post("/entailment", {"pairs": [list(pair) for pair in pairs]})["results"]
+
+
+if __name__ == "__main__":
+    # python -m apis.modelserver, then point the bots at it with MODEL_SERVER_URL
+    config = get_config()
+    ModelServer(
+        max_batch_size=int(config.get('MODEL_SERVER_BATCH_SIZE', 32)),
+        max_delay=float(config.get('MODEL_SERVER_BATCH_DELAY_MS', 5)) / 1000
+    ).serve(config.get('MODEL_SERVER_URL', 'unix:///tmp/modbot-models.sock'))
@@ -1,77 +1,181 @@
-import re
+import json
 
 import openai
 
-from apis.helper import get_config, MISINFO, NOT_MISINFO, UNCLEAR
+from apis.helper import get_config, get_http_budget, MISINFO, NOT_MISINFO, UNCLEAR
+from apis.httpclient import get_http_client
 from constants import MANIPULATED_CONTENT, FAKE_CONTENT, IMPOSTER_CONTENT, OUT_OF_CONTEXT
 
+# Rationale returned when the LLM could not be reached or gave an unparseable answer
+OPENAI_FAILED_MSG = "OpenAI response failed"
+
+MISINFO_LABELS = (MISINFO, NOT_MISINFO, UNCLEAR)
+MISINFO_TYPES = (MANIPULATED_CONTENT, FAKE_CONTENT, IMPOSTER_CONTENT, OUT_OF_CONTEXT)
+
+SYSTEM_PROMPT = (
+    "You are a misinformation detection bot. Determine if each statement is misinformation or not. "
+    "Provide a URL to support this evidence if available. Do not make up facts. "
+    f"If the statement is misinformation, also determine which type it belongs to: {', '.join(MISINFO_TYPES)}. "
+    "Respond with a single JSON object with the keys \"conclusion\" (one of "
+    f"{', '.join(MISINFO_LABELS)}), \"rationale\" and \"type\" (null unless it is {MISINFO}) and nothing else."
+)
+
+BATCH_SYSTEM_PROMPT = (
+    "You are a misinformation detection bot. You are given a JSON array of objects with the keys \"id\" "
+    "and \"text\". Determine for each text on its own if it is misinformation or not. "
+    "Provide a URL to support this evidence if available. Do not make up facts. "
+    f"If a text is misinformation, also determine which type it belongs to: {', '.join(MISINFO_TYPES)}. "
+    "Respond with a JSON array containing exactly one object per id with the keys \"id\", \"conclusion\" (one of "
+    f"{', '.join(MISINFO_LABELS)}), \"rationale\" and \"type\" (null unless it is {MISINFO}) and nothing else."
+)
+
+# Few shot examples of statements and the structured answer we expect back
+FEW_SHOT_EXAMPLES = [
+    ("Climate change is a hoax by the left wing media.",
+     {"conclusion": MISINFO, "rationale": "scientific research by reputable sources like Stanford have shown that carbon emissions have changed modern climte conditions. Example url: https://www.factcheck.org/2022/08/unequivocal-evidence-that-humans-cause-climate-change-contrary-to-posts-of-old-video/", "type": FAKE_CONTENT}),
+    ("The earth is round",
+     {"conclusion": NOT_MISINFO, "rationale": "although the Earth is not perfectly round, we know it is approximately so due to numerous scientific measurements. Example url: https://fullfact.org/online/earth-is-spherical-not-flat/", "type": None}),
+    ("My mother's name is Jasper",
+     {"conclusion": UNCLEAR, "rationale": "Personal information cannot be confirmed or refuted by a detection bot.", "type": None}),
+    ("Many people have experienced negative side effects from COVID vaccines and that's proof that they are basically poison. Medicine shouldn't make you sick!",
+     {"conclusion": MISINFO, "rationale": "Side effects are rare and mostly mild, and vaccines have been shown to be safe and effective. Example url: https://www.cdc.gov/coronavirus/2019-ncov/vaccines/safety/safety-of-vaccines.html", "type": MANIPULATED_CONTENT}),
+    ("Melting glaciers will result in the ocean absorbing more CO2, so really it isn't a problem.",
+     {"conclusion": MISINFO, "rationale": "Oceans absorbing more CO2 causes acidification and does not offset the effects of melting glaciers.", "type": OUT_OF_CONTEXT}),
+    ("New Yorker Times: Donald Trump told us in an interview that 'Trans youth need to be protected.'",
+     {"conclusion": MISINFO, "rationale": "The quote is misattributed and the New Yorker Times is not a real news source.", "type": IMPOSTER_CONTENT}),
+]
+
+
+def parse_misinfo_response(output):
+    '''
+    Strictly parse the JSON answer of the LLM. Raises a ValueError unless it has a valid 
+    conclusion, a rationale, and a valid type exactly when the conclusion is misinformation.
+    '''
+    result = json.loads(output)
+    if not isinstance(result, dict):
+        raise ValueError(f"Expected a JSON object, got {output}")
+
+    conclusion = result.get("conclusion")
+    rationale = result.get("rationale")
+    misinfo_type = result.get("type")
+    if conclusion not in MISINFO_LABELS:
+        raise ValueError(f"Unknown conclusion {conclusion}")
+    if not isinstance(rationale, str) or not rationale:
+        raise ValueError("Missing rationale")
+    if conclusion == MISINFO and misinfo_type not in MISINFO_TYPES:
+        raise ValueError(f"Unknown misinformation type {misinfo_type}")
+    if conclusion != MISINFO:
+        misinfo_type = None
+    return conclusion, rationale, misinfo_type
+
+
+def parse_misinfo_batch_response(output, ids):
+    '''
+    Parse the JSON array answer to a batch. Raises a ValueError unless every id was answered exactly
+    once, since answers can't be matched to statements otherwise. Returns a map from ids to the parsed
+    answer, or to the ValueError of an answer that doesn't parse, which only fails its own statement.
+    '''
+    answers = json.loads(output)
+    if not isinstance(answers, list) or not all(isinstance(answer, dict) for answer in answers):
+        raise ValueError(f"Expected a JSON array of objects, got {output}")
+    answered = [answer.get("id") for answer in answers]
+    if sorted(map(repr, answered)) != sorted(map(repr, ids)):
+        raise ValueError(f"Expected one answer for each of the ids {ids}, got {answered}")
+
+    results = {}
+    for answer in answers:
+        try:
+            results[answer["id"]] = parse_misinfo_response(json.dumps(answer))
+        except ValueError as e:
+            results[answer["id"]] = e
+    return results
+
+
 class OpenAI:
     def __init__(self):
         config = get_config()
         openai.organization = config['OPENAI_ORG']
         openai.api_key = config['OPENAI_KEY']
-        self.misinfo_response_re = re.compile(f"({MISINFO}|{NOT_MISINFO}|{UNCLEAR}): (.*)")
-        self.classification_re = re.compile(f"({MANIPULATED_CONTENT}|{FAKE_CONTENT}|{IMPOSTER_CONTENT}|{OUT_OF_CONTEXT})")
+        # A request can't outlive the llm provider's fan-out deadline
+        self.timeout = min(float(config.get('OPENAI_HTTP_TIMEOUT', 30)), get_http_budget("llm"))
+        self.http = get_http_client()
 
-    def misinfo_detection(self, statement):
+        self.few_shot_messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        for statement, answer in FEW_SHOT_EXAMPLES:
+            self.few_shot_messages.append({"role": "user", "content": statement})
+            self.few_shot_messages.append({"role": "assistant", "content": json.dumps(answer)})
+
+        # The same examples as a single batch, so batched calls see the array format they should answer in
+        self.batch_few_shot_messages = [
+            {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": json.dumps([{"id": i + 1, "text": statement} for i, (statement, _) in enumerate(FEW_SHOT_EXAMPLES)])},
+            {"role": "assistant", "content": json.dumps([{"id": i + 1, **answer} for i, (_, answer) in enumerate(FEW_SHOT_EXAMPLES)])},
+        ]
+
+    async def misinfo_detection(self, statement):
+        '''
+        Returns the conclusion, rationale and misinformation type (None unless the conclusion 
+        is misinformation) from a single LLM call. Errors talking to OpenAI are raised so the 
+        circuit breaker can see them; an answer that doesn't parse counts as a failed response.
+        '''
+        # Reuse the pooled session instead of letting openai open a new one per call
+        openai.aiosession.set(self.http.get_session())
+        response = await openai.ChatCompletion.acreate(
+            model="gpt-4",
+            request_timeout=self.timeout,
+            messages=self.few_shot_messages + [{"role": "user", "content": f"{statement}"}]
+        )
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a misinformation detection bot. Determine if each statement is misinformation or not. Provide a URL to support this evidence if available. Do not make up facts."},
-                    {"role": "user", "content": "Climate change is a hoax by the left wing media."},
-                    {"role": "assistant", "content": f"{MISINFO}: scientific research by reputable sources like Stanford have shown that carbon emissions have changed modern climte conditions. Example url: https://www.factcheck.org/2022/08/unequivocal-evidence-that-humans-cause-climate-change-contrary-to-posts-of-old-video/"},
-                    {"role": "user", "content": "The earth is round"},
-                    {"role": "assistant", "content": f"{NOT_MISINFO}: although the Earth is not perfectly round, we know it is approximately so due to numerous scientific measurements. Example url: https://fullfact.org/online/earth-is-spherical-not-flat/"},
-                    {"role": "user", "content": "My mother's name is Jasper"},
-                    {"role": "assistant", "content": f"{UNCLEAR}: Personal information cannot be confirmed or refuted by a detection bot."},
-                    {"role": "user", "content": f"{statement}"}
-                ]
-            )
             output = response['choices'][0]['message']['content']
             print(output)
 
-            # Parse the output to get whether it is misinformation or not 
-            match = self.misinfo_response_re.match(output)
-            if match:
-                result = match.group(1)
-                rationale = match.group(2)
-                return result, rationale
+            # Parse the output to get whether it is misinformation or not and what type
+            return parse_misinfo_response(output)
 
-        except Exception as e:
+        except (ValueError, KeyError, IndexError) as e:
             print(f"OpenAI misinfo_detection function failed: {e}")
            
-        return UNCLEAR, "OpenAI response failed"
+        return UNCLEAR, OPENAI_FAILED_MSG, None
 
-    
-    def get_misinfo_type(self, statement):
+    async def misinfo_detection_batch(self, statements):
+        '''
+        Classify several statements with one LLM call, so the few shot prefix is only sent once.
+        Returns one (conclusion, rationale, type) tuple per statement, in order.
+        '''
+        if len(statements) == 1:
+            return [await self.misinfo_detection(statements[0])]
+
+        results = [(UNCLEAR, OPENAI_FAILED_MSG, None)] * len(statements)
+        # Statements go in as JSON with explicit ids, so their text can't be mistaken for the numbering
+        ids = list(range(1, len(statements) + 1))
+        request = json.dumps([{"id": statement_id, "text": statement} for statement_id, statement in zip(ids, statements)])
+        # Reuse the pooled session instead of letting openai open a new one per call
+        openai.aiosession.set(self.http.get_session())
+        response = await openai.ChatCompletion.acreate(
+            model="gpt-4",
+            request_timeout=self.timeout,
+            messages=self.batch_few_shot_messages + [{"role": "user", "content": request}]
+        )
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": f"You are a misinformation classification bot. Determine what type of misinformation the following statement belongs to: {MANIPULATED_CONTENT}, {FAKE_CONTENT}, {IMPOSTER_CONTENT}, {OUT_OF_CONTEXT}. Only output the type and nothing else."},
-                    {"role": "user", "content": "The moon landing was faked. NASA is lying to us, and the earth is flat."},
-                    {"role": "assistant", "content": FAKE_CONTENT},
-                    {"role": "user", "content": "Many people have experienced negative side effects from COVID vaccines and that's proof that they are basically poison. Medicine shouldn't make you sick!"},
-                    {"role": "assistant", "content": MANIPULATED_CONTENT},
-                    {"role": "user", "content": "Melting glaciers will result in the ocean absorbing more CO2, so really it isn't a problem."},
-                    {"role": "assistant", "content": OUT_OF_CONTEXT},
-                    {"role": "user", "content": "New Yorker Times: Donald Trump told us in an interview that 'Trans youth need to be protected.' (the thought being with the above imposter content that there is a quote misattributed to a real person, and that a fake news source was made up)."},
-                    {"role": "assistant", "content": IMPOSTER_CONTENT},
-                    {"role": "user", "content": f"{statement}"}
-                ]
-            )
             output = response['choices'][0]['message']['content']
-            match = self.classification_re.match(output)
-            if match:
-                return output
-        except Exception as e:
-            print(f"OpenAI misinfo_detection function failed: {e}")
-        return None
-    
+            print(output)
+
+            answers = parse_misinfo_batch_response(output, ids)
+            for index, statement_id in enumerate(ids):
+                # A malformed answer only fails its own statement, not the whole batch
+                if isinstance(answers[statement_id], ValueError):
+                    print(f"OpenAI misinfo_detection_batch could not parse the answer for {statement_id}: {answers[statement_id]}")
+                else:
+                    results[index] = answers[statement_id]
+
+        except (ValueError, KeyError, IndexError) as e:
+            print(f"OpenAI misinfo_detection_batch function failed: {e}")
+
+        return results
+
         
-    def embedding_sim(self, sent1, sent2):
-        response = openai.ChatCompletion.create(
+    async def embedding_sim(self, sent1, sent2):
+        response = await openai.ChatCompletion.acreate(
             model="gpt-4",
             messages=[
                 {"role": "system", "content": "You are a cosine similarity embedding model that determines how similar two pieces of text are with a 0 to 1 score with 0.5 being the cutoff threshold."},
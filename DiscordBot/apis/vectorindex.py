@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class VectorIndex:
+    '''
+    Fixed capacity index of recent embeddings. Rows are L2 normalized, so a single matrix-vector
+    product gives the cosine similarity to everything in the index. Once full, the oldest row is 
+    overwritten. If a path is given the matrix lives in a memory-mapped .npy file and the 
+    metadata in an append-only .jsonl log next to it, so the index survives restarts.
+    '''
+
+    def __init__(self, capacity=10000, path=None):
+        self.capacity = capacity
+        self.path = path
+        self.vectors = None
+        self.metadata = [None] * capacity
+        self.size = 0
+        self.next_row = 0
+        self.lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self._load()
+
+    def _allocate(self, dim):
+        if self.path:
+            self.vectors = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.float32, shape=(self.capacity, dim))
+        else:
+            self.vectors = np.zeros((self.capacity, dim), dtype=np.float32)
+
+    def _reset(self, dim):
+        # The embedding model changed, the stored vectors can't be compared with the new ones
+        print(f"Vector index {self.path or 'in memory'} holds {self.vectors.shape[-1]} dimensional vectors, got {dim}, starting a fresh index")
+        self.vectors = None
+        self._allocate(dim)
+        self.metadata = [None] * self.capacity
+        self.size = 0
+        self.next_row = 0
+        if self.path:
+            open(self._meta_path(), 'w').close()
+
+    def _meta_path(self):
+        return self.path + ".jsonl"
+
+    def _load(self):
+        self.vectors = np.load(self.path, mmap_mode='r+')
+        self.capacity = self.vectors.shape[0]
+        self.metadata = [None] * self.capacity
+        if not os.path.exists(self._meta_path()):
+            return
+
+        # Replay the log (later writes to a row win), then compact it
+        order = []
+        with open(self._meta_path()) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from a crash, the row is simply treated as empty
+                    continue
+                self.metadata[entry['row']] = entry['meta']
+                order.append(entry['row'])
+
+        live = [row for row in range(self.capacity) if self.metadata[row] is not None]
+        self.size = live[-1] + 1 if live else 0
+        self.next_row = (order[-1] + 1) % self.capacity if order else 0
+        with open(self._meta_path(), 'w') as f:
+            # Keep the oldest-first order so the ring position is preserved on the next load
+            for row in sorted(live, key=lambda r: (r - self.next_row) % self.capacity):
+                f.write(json.dumps({"row": row, "meta": self.metadata[row]}) + "\n")
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def add(self, vector, meta):
+        vector = self._normalize(vector)
+        with self.lock:
+            if self.vectors is None:
+                self._allocate(vector.shape[-1])
+            elif self.vectors.shape[-1] != vector.shape[-1]:
+                self._reset(vector.shape[-1])
+            row = self.next_row
+            self.vectors[row] = vector
+            self.metadata[row] = meta
+            self.next_row = (row + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+
+            if self.path:
+                self.vectors.flush()
+                with open(self._meta_path(), 'a') as f:
+                    f.write(json.dumps({"row": row, "meta": meta}) + "\n")
+        return row
+
+    def search(self, vector, k=1):
+        # Returns up to k (similarity, metadata) pairs, most similar first
+        with self.lock:
+            if self.vectors is None or self.size == 0 or self.vectors.shape[-1] != np.shape(vector)[-1]:
+                return []
+            # The ring fills rows in order, so the first size rows are the live ones
+            sims = self.vectors[:self.size] @ self._normalize(vector)
+            k = min(k, len(sims))
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            return [(float(sims[row]), self.metadata[row]) for row in top if self.metadata[row] is not None]
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,266 @@
+import bisect
+import heapq
+import itertools
+import time
+from collections import defaultdict
+
+from report import ABUSE_PROMPT
+
+
+class ReportBacklog:
+    '''
+    Submitted reports waiting for moderator review. A heap keeps the most urgent report on top
+    (highest severity first, oldest first within a severity) and a dict indexes reports by ID.
+    Removing a report just drops it from the dict; its heap entry goes stale and is skipped
+    when it reaches the top.
+
+    Reports of a message that already has a report waiting or in review are merged into that
+    report (see add), so a viral post is a single backlog item however often it is reported.
+
+    Moderators claim reports with a lease. A claimed report leaves the heap until its review is
+    completed, it is released, or the lease runs out without being renewed. None of the claim
+    methods await, so on the event loop each of them is atomic and two moderators can never
+    be handed the same report.
+    '''
+
+    def __init__(self, lease_seconds=30 * 60):
+        self.heap = []
+        self.reports = {}
+        self.entries = {}
+        self.counter = itertools.count()
+        self.lease_seconds = lease_seconds
+        self.leases = {} # Map from report IDs to (moderator ID, lease expiry, report)
+        self.by_message = {} # Map from reported message IDs to the report their group was merged into
+
+        # Secondary indexes over the waiting reports, used to filter list-reports
+        self.by_reporting_user = defaultdict(set)
+        self.by_reported_user = defaultdict(set)
+        self.by_abuse_type = defaultdict(set)
+        self.by_severity = [] # Sorted (severity, report ID) pairs
+        self.by_date = [] # Sorted (timestamp, report ID) pairs
+
+    def _index(self, report_id, report):
+        for reporting_user_id in report.get_reporting_user_ids():
+            self.by_reporting_user[reporting_user_id].add(report_id)
+        self.by_reported_user[report.reported_user_id].add(report_id)
+        self.by_abuse_type[report.get_answer(ABUSE_PROMPT)].add(report_id)
+        bisect.insort(self.by_severity, (report.get_group_severity(), report_id))
+        bisect.insort(self.by_date, (report.timestamp, report_id))
+
+    def _unindex(self, report_id, report):
+        keyed = [(self.by_reporting_user, reporting_user_id) for reporting_user_id in report.get_reporting_user_ids()]
+        for index, key in keyed + [(self.by_reported_user, report.reported_user_id), (self.by_abuse_type, report.get_answer(ABUSE_PROMPT))]:
+            index[key].discard(report_id)
+            if not index[key]:
+                del index[key]
+        for ordered, key in [(self.by_severity, report.get_group_severity()), (self.by_date, report.timestamp)]:
+            pos = bisect.bisect_left(ordered, (key, report_id))
+            if pos < len(ordered) and ordered[pos] == (key, report_id):
+                del ordered[pos]
+
+    def push(self, report):
+        report_id = str(report.get_report_id())
+        if report_id in self.reports:
+            self._unindex(report_id, self.reports[report_id])
+        seq = next(self.counter)
+        self.reports[report_id] = report
+        self.entries[report_id] = seq
+        self._index(report_id, report)
+        heapq.heappush(self.heap, (report.get_priority_key(), seq, report_id))
+
+    def group_for(self, message_id):
+        # The waiting or claimed report that reports of this message are merged into, if any
+        report_id = self.by_message.get(message_id)
+        if report_id is None:
+            return None
+        if report_id in self.reports:
+            return self.reports[report_id]
+        if report_id in self.leases:
+            return self.leases[report_id][2]
+        # The group was reviewed, the next report of the message starts a new one
+        del self.by_message[message_id]
+        return None
+
+    def add(self, report):
+        '''
+        Adds a submitted report, merging it into the group of its message if there is one. Returns
+        the report that stands for the group.
+        '''
+        group = self.group_for(report.message_id)
+        if group is None:
+            self.by_message[report.message_id] = str(report.get_report_id())
+            self.push(report)
+            return report
+        if str(group.get_report_id()) in self.leases:
+            # Already under review, the moderator sees the extra report when reopening it
+            group.merge(report)
+        else:
+            # More reporters can raise the group's priority, so it gets a new heap entry
+            self.remove(group.get_report_id())
+            group.merge(report)
+            self.push(group)
+        return group
+
+    def bulk_load(self, reports):
+        # Builds the heap in one heapify instead of pushing reports one at a time
+        groups = {}
+        for report in sorted(reports, key=lambda report: report.timestamp):
+            if report.message_id in groups:
+                groups[report.message_id].merge(report)
+            else:
+                groups[report.message_id] = report
+        for message_id, report in groups.items():
+            report_id = str(report.get_report_id())
+            seq = next(self.counter)
+            self.reports[report_id] = report
+            self.entries[report_id] = seq
+            self.by_message[message_id] = report_id
+            self.heap.append((report.get_priority_key(), seq, report_id))
+            for reporting_user_id in report.get_reporting_user_ids():
+                self.by_reporting_user[reporting_user_id].add(report_id)
+            self.by_reported_user[report.reported_user_id].add(report_id)
+            self.by_abuse_type[report.get_answer(ABUSE_PROMPT)].add(report_id)
+            self.by_severity.append((report.get_group_severity(), report_id))
+            self.by_date.append((report.timestamp, report_id))
+        heapq.heapify(self.heap)
+        self.by_severity.sort()
+        self.by_date.sort()
+
+    def _discard_stale(self):
+        while self.heap and self.entries.get(self.heap[0][2]) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+
+    def peek(self):
+        self._discard_stale()
+        if not self.heap:
+            return None
+        return self.reports[self.heap[0][2]]
+
+    def pop(self):
+        self._discard_stale()
+        if not self.heap:
+            return None
+        _, _, report_id = heapq.heappop(self.heap)
+        del self.entries[report_id]
+        report = self.reports.pop(report_id)
+        self._unindex(report_id, report)
+        return report
+
+    def get(self, report_id):
+        return self.reports.get(str(report_id))
+
+    def remove(self, report_id):
+        report_id = str(report_id)
+        self.entries.pop(report_id, None)
+        report = self.reports.pop(report_id, None)
+        if report is not None:
+            self._unindex(report_id, report)
+
+        # Rebuild once stale entries make up most of the heap so it doesn't grow without bound
+        if len(self.heap) > 2 * len(self.reports) + 32:
+            self.heap = [entry for entry in self.heap if self.entries.get(entry[2]) == entry[1]]
+            heapq.heapify(self.heap)
+        return report
+
+    def claim_next(self, moderator_id):
+        self.expire_leases()
+        report = self.pop()
+        if report is not None:
+            self._lease(report, moderator_id)
+        return report
+
+    def claim(self, report_id, moderator_id):
+        '''
+        Claim a specific report. Returns None if it doesn't exist or another moderator holds a live lease.
+        '''
+        report_id = str(report_id)
+        self.expire_leases()
+        if report_id in self.leases:
+            holder, _, report = self.leases[report_id]
+            if holder != moderator_id:
+                return None
+        else:
+            report = self.remove(report_id)
+            if report is None:
+                return None
+        self._lease(report, moderator_id)
+        return report
+
+    def _lease(self, report, moderator_id):
+        self.leases[str(report.get_report_id())] = (moderator_id, time.monotonic() + self.lease_seconds, report)
+
+    def renew(self, report_id, moderator_id):
+        report_id = str(report_id)
+        if report_id not in self.leases or self.leases[report_id][0] != moderator_id:
+            return False
+        self._lease(self.leases[report_id][2], moderator_id)
+        return True
+
+    def release(self, report_id):
+        # Give a claimed report back to the backlog
+        lease = self.leases.pop(str(report_id), None)
+        if lease is None:
+            return None
+        self.push(lease[2])
+        return lease[2]
+
+    def complete(self, report_id):
+        lease = self.leases.pop(str(report_id), None)
+        return lease[2] if lease else None
+
+    def expire_leases(self, now=None):
+        now = time.monotonic() if now is None else now
+        expired = [report_id for report_id, (_, expires, _) in self.leases.items() if expires <= now]
+        return [self.release(report_id) for report_id in expired]
+
+    def holder(self, report_id):
+        lease = self.leases.get(str(report_id))
+        return lease[0] if lease else None
+
+    @staticmethod
+    def _range(ordered, low, high):
+        start = 0 if low is None else bisect.bisect_left(ordered, (low,))
+        end = len(ordered) if high is None else bisect.bisect_left(ordered, (high, chr(0x10ffff)))
+        return {report_id for _, report_id in ordered[start:end]}
+
+    def query(self, min_severity=None, max_severity=None, since=None, until=None, reporting_user=None,
+              reported_user=None, abuse_type=None, after=None, limit=None):
+        '''
+        Waiting reports matching every given filter, most urgent first. Each filter is answered by
+        one of the secondary indexes and the matches are intersected, smallest set first. after is 
+        the priority key of the last report of the previous page, only reports after it are returned.
+        '''
+        candidates = []
+        if min_severity is not None or max_severity is not None:
+            candidates.append(self._range(self.by_severity, min_severity, max_severity))
+        if since is not None or until is not None:
+            candidates.append(self._range(self.by_date, since, until))
+        if reporting_user is not None:
+            candidates.append(self.by_reporting_user.get(reporting_user, set()))
+        if reported_user is not None:
+            candidates.append(self.by_reported_user.get(reported_user, set()))
+        if abuse_type is not None:
+            candidates.append(self.by_abuse_type.get(abuse_type, set()))
+
+        if candidates:
+            candidates.sort(key=len)
+            report_ids = set.intersection(*candidates)
+        else:
+            report_ids = self.reports.keys()
+
+        keys = ((self.reports[report_id].get_priority_key(), report_id) for report_id in report_ids)
+        if after is not None:
+            keys = (key for key in keys if key > after)
+        # Only the page is ordered, not every match
+        keys = sorted(keys) if limit is None else heapq.nsmallest(limit, keys)
+        return [self.reports[report_id] for _, report_id in keys]
+
+    def in_priority_order(self):
+        live = [entry for entry in self.heap if self.entries.get(entry[2]) == entry[1]]
+        return [self.reports[report_id] for _, _, report_id in sorted(live)]
+
+    def __contains__(self, report_id):
+        return str(report_id) in self.reports
+
+    def __len__(self):
+        return len(self.reports)
@@ -1,20 +1,36 @@
 # bot.py
+import asyncio
 import json
 import logging
 import os
 import pdb
 import re
 import requests
+import time
 
 import discord
 from discord.ext import commands
 
-from apis.helper import MISINFO, NOT_MISINFO, UNCLEAR
+from apis.helper import get_config, get_provider_timeout, run_blocking, run_io, MISINFO, NOT_MISINFO, UNCLEAR, UNAVAILABLE, WAITING
+from apis.cache import TTLCache, SqliteCacheBackend, text_key
 from apis.claimbuster import ClaimBuster
+from apis.batcher import MicroBatcher
+from apis.breaker import CircuitBreaker
+from apis.consensus import has_supporting_facts, merge_fact_checks
+from apis.fanout import FanOut
+from apis.embedding import create_text_analysis
 from apis.googlefactcheck import GoogleFactCheck
-from apis.openaichat import OpenAI
+from apis.httpclient import get_http_client
+from apis.localfactcheck import LocalFactCheck
+from apis.openaichat import OpenAI, OPENAI_FAILED_MSG
+from apis.models import get_model_registry, EMBEDDING_MODEL, ENTAILMENT_MODEL
+from apis.vectorindex import VectorIndex
 from report import Report
 from mod import ModReview
+from backlog import ReportBacklog
+from store import ReportStore, PENDING, IN_REVIEW, DONE
+from sweeper import SessionSweeper
+from dispatcher import SendDispatcher, MAX_MESSAGE_LENGTH
 
 
 # Set up logging to the console
@@ -35,26 +51,225 @@ with open(token_path) as f:
 
 
 class ModBot(discord.Client):
+    # Harmless post used to check whether a provider that tripped its circuit breaker is back
+    PROBE_TEXT = "The earth is round"
+    REMOVED_POST_MSG = "*Remove offending post*"
+    REMOVE_FAILED_MSG = "*Could not remove the post, please remove it manually*"
+    # The quoted post is never shortened below this when a summary is too long for one message
+    POST_PREVIEW_LENGTH = 300
+
     def __init__(self): 
         intents = discord.Intents.default()
         intents.message_content = True
         super().__init__(command_prefix='.', intents=intents)
+        self.started_at = time.perf_counter()
+        self.startup_phases = {} # Map from startup phase to how long it took in seconds
         self.group_num = None
         self.mod_channels = {} # Map from guild to the mod channel id for that guild
         self.reports = {} # Map from user IDs to the state of their report
         self.mod_review = {} # Map from user IDs to mod reviews
-        self.submitted_reports = [] # List of submitted reports
+        self.submitted_reports = None # Submitted reports, most urgent first
+        self.group_notifications = {} # Map from report group IDs to the mod channel message announcing them
 
         # Initialize the various apis
         self.openai = OpenAI()
         self.claimbuster = ClaimBuster()
         self.googlefactcheck = GoogleFactCheck()
+        self.localfactcheck = LocalFactCheck(defer_load=True)
+
+        # Submitted reports are persisted, restore whatever was still waiting for review
+        config = get_config()
+        review_timeout = float(config.get('REVIEW_IDLE_TIMEOUT', 30 * 60))
+        self.submitted_reports = ReportBacklog(lease_seconds=review_timeout)
+        self.report_store = ReportStore(config.get('REPORT_DB_PATH', 'reports.db'))
+        records = self.report_store.load_pending()
+        self.submitted_reports.bulk_load(records)
+        print(f"Restored {len(records)} pending reports")
+
+        # Every outgoing message is queued per channel to stay within Discord's rate limits
+        self.dispatcher = SendDispatcher(
+            rate=int(config.get('SEND_RATE', 5)),
+            per=float(config.get('SEND_RATE_PERIOD', 5))
+        )
+
+        # Everyone reporting a viral post links the same message, it is fetched from Discord once
+        self.reported_messages = TTLCache(
+            max_size=int(config.get('MESSAGE_CACHE_SIZE', 1024)),
+            ttl=float(config.get('MESSAGE_CACHE_TTL', 10 * 60))
+        )
+        self.message_fetches = {} # Map from message IDs to fetches that are in flight
+
+        # Abandoned report flows and reviews are expired once they have been idle for too long
+        self.sweeper = SessionSweeper(self.expire_session, interval=float(config.get('SWEEP_INTERVAL', 30)))
+        self.sweeper.add_kind("report", self.reports, float(config.get('REPORT_IDLE_TIMEOUT', 15 * 60)))
+        self.sweeper.add_kind("review", self.mod_review, review_timeout)
+
+        # Reposts of the same text reuse the earlier evaluation instead of calling every api again
+        cache_path = config.get('EVAL_CACHE_PATH')
+        self.eval_cache = TTLCache(
+            max_size=int(config.get('EVAL_CACHE_SIZE', 4096)),
+            ttl=float(config.get('EVAL_CACHE_TTL', 6 * 60 * 60)),
+            backend=SqliteCacheBackend(cache_path) if cache_path else None
+        )
+
+        # Lightly edited reposts are caught by comparing embeddings against recently evaluated posts
+        self.text_analysis = create_text_analysis()
+        self.dedup_similarity = float(config.get('DEDUP_SIMILARITY', 0.92))
+        self.recent_posts = VectorIndex(
+            capacity=int(config.get('DEDUP_CAPACITY', 10000)),
+            path=config.get('DEDUP_INDEX_PATH')
+        )
+
+        # Posts arriving close together are classified by the LLM in one request
+        self.llm_batcher = MicroBatcher(
+            self.openai.misinfo_detection_batch,
+            max_batch_size=int(config.get('LLM_BATCH_SIZE', 8)),
+            max_delay=float(config.get('LLM_BATCH_DELAY_MS', 20)) / 1000
+        )
+
+        # All enabled providers are queried at the same time, each with its own deadline. The Google
+        # Fact Check API is only called when the local store has nothing similar, with its own breaker
+        # that only sees the real API calls
+        self.fact_check_providers = ["localfactcheck", "googlefactcheck", "claimbuster"]
+        fallbacks = {"googlefactcheck": "localfactcheck"}
+        providers = {
+            "llm": self._llm_signal,
+            "localfactcheck": self.localfactcheck.get_matching_facts,
+            "googlefactcheck": self.googlefactcheck.get_matching_facts,
+            "claimbuster": self.claimbuster.get_matching_facts,
+        }
+        # Empty entries (e.g. a trailing comma) are ignored and an empty value enables everything
+        enabled = list(dict.fromkeys(name.strip() for name in (config.get('ENABLED_PROVIDERS') or ",".join(providers)).split(',') if name.strip()))
+        unknown = [name for name in enabled if name not in providers]
+        if unknown:
+            raise Exception(f"Unknown provider {', '.join(unknown)} in ENABLED_PROVIDERS, the providers are: {', '.join(providers)}")
+        self.fanout = FanOut(default_timeout=float(config.get('PROVIDER_TIMEOUT', 15)))
+        for name in enabled:
+            timeout = get_provider_timeout(name)
+
+            # Providers that keep failing or stalling are skipped until a background probe succeeds
+            breaker = CircuitBreaker(
+                name,
+                window=int(config.get('BREAKER_WINDOW', 20)),
+                error_rate=float(config.get('BREAKER_ERROR_RATE', 0.5)),
+                slow_call=float(config.get('BREAKER_SLOW_FRACTION', 0.8)) * timeout,
+                cooldown=float(config.get('BREAKER_COOLDOWN', 30))
+            )
+            self.fanout.register(name, providers[name], timeout, breaker=breaker, probe_input=self.PROBE_TEXT,
+                                 probe_kwargs={"use_cache": False} if name in self.fact_check_providers else None,
+                                 fallback_for=fallbacks.get(name), sufficient=lambda result: has_supporting_facts(result[1]))
+
+        # Models and fact check exports are loaded in the background once the bot is connecting,
+        # posts that arrive before that are held until they are ready
+        self.warm_up_inference = config.get('WARMUP_INFERENCE', 'true').lower() == 'true'
+        self.models_ready = asyncio.Event()
+        self.queued_posts = 0
+        self.sweeper_task = None
+        self.load_task = None
+        self.startup_phases["init"] = time.perf_counter() - self.started_at
+
+    async def setup_hook(self):
+        self.sweeper_task = asyncio.create_task(self.sweeper.run())
+        self.load_task = asyncio.create_task(self.load_models())
+
+    async def load_models(self):
+        '''
+        Staged startup: the heavy imports, model loads and an optional warm-up inference run on the
+        model executor while the gateway connects, so the bot is online within seconds.
+        '''
+        registry = get_model_registry()
+        start = time.perf_counter()
+        try:
+            await run_blocking(self.localfactcheck.load_all)
+            self.startup_phases["fact check exports"] = time.perf_counter() - start
+
+            if not self.text_analysis.is_remote:
+                # With a model server the weights live there, the warm-up below checks it is reachable
+                start = time.perf_counter()
+                for name in registry.LOADERS:
+                    if registry.is_enabled(name):
+                        await run_blocking(registry.get, name)
+                self.startup_phases["models"] = time.perf_counter() - start
+
+            if self.warm_up_inference:
+                # The first inference pays for lazy initialization inside the libraries
+                start = time.perf_counter()
+                if registry.is_enabled(EMBEDDING_MODEL):
+                    await run_blocking(self.text_analysis.embed, self.PROBE_TEXT)
+                    await run_blocking(self.localfactcheck.warm_up)
+                if registry.is_enabled(ENTAILMENT_MODEL):
+                    await run_blocking(self.text_analysis.is_entailment, self.PROBE_TEXT, self.PROBE_TEXT)
+                self.startup_phases["warm-up"] = time.perf_counter() - start
+        except Exception as e:
+            # Posts are still evaluated, the failing signals show up as unavailable
+            print(f"Loading models failed: {e}")
+        finally:
+            self.startup_phases["ready for posts"] = time.perf_counter() - self.started_at
+            self.models_ready.set()
+            print("Startup: " + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in self.startup_phases.items()))
+
+    async def expire_session(self, kind, key, session):
+        if kind == "review":
+            # The lease ran out with the session, put the report back so another moderator can pick it up
+            record = session.report
+            if self.submitted_reports.holder(record.get_report_id()) not in (key, None):
+                # Another moderator has already claimed it again
+                return
+            self.submitted_reports.release(record.get_report_id())
+            self.report_store.set_status(record.get_report_ids(), PENDING)
+            if record.guild_id in self.mod_channels:
+                await self.dispatcher.send(self.mod_channels[record.guild_id], f"Review of report {record.get_report_id()} was idle for too long, it is back in the backlog.", coalesce=True)
+
+    async def get_reported_message(self, channel, message_id):
+        '''
+        channel.fetch_message with a shared cache. Concurrent lookups of the same message wait for a
+        single fetch; NotFound is raised to every caller and not cached.
+        '''
+        message = self.reported_messages.get(message_id)
+        if message is not None:
+            return message
+        if message_id not in self.message_fetches:
+            self.message_fetches[message_id] = asyncio.ensure_future(channel.fetch_message(message_id))
+        fetch = self.message_fetches[message_id]
+        try:
+            message = await asyncio.shield(fetch)
+        finally:
+            if fetch.done():
+                self.message_fetches.pop(message_id, None)
+        self.reported_messages.set(message_id, message)
+        return message
+
+    async def notify_report_group(self, group):
+        # One message per group in the mod channel, edited as more reports of the post come in
+        mod_channel = self.mod_channels[group.guild_id]
+        if group.get_report_count() == 1:
+            text = "Received new report."
+        else:
+            text = (f"Received {group.get_report_count()} reports of {group.get_post_url()} from "
+                    f"{len(group.get_reporting_user_ids())} users, combined severity {group.get_group_severity()}. "
+                    f"Review them with `{ModReview.REVIEW_REPORT} {group.get_report_id()}`.")
+        notification = self.group_notifications.get(group.get_report_id())
+        if notification is not None and await self.dispatcher.edit(mod_channel, notification, text) is not None:
+            return
+        self.group_notifications[group.get_report_id()] = await self.dispatcher.send(mod_channel, text)
+
+    async def close(self):
+        # The tasks only exist once setup_hook has run, e.g. not if logging in failed
+        for task in (self.sweeper_task, self.load_task):
+            if task is not None:
+                task.cancel()
+        await self.dispatcher.close()
+        await get_http_client().close()
+        self.report_store.close()
+        await super().close()
 
     async def on_ready(self):
         print(f'{self.user.name} has connected to Discord! It is these guilds:')
         for guild in self.guilds:
             print(f' - {guild.name}')
         print('Press Ctrl-C to quit.')
+        if "connected" not in self.startup_phases:
+            self.startup_phases["connected"] = time.perf_counter() - self.started_at
 
         # Parse the group number out of the bot's name
         match = re.search('[gG]roup (\d+) [bB]ot', self.user.name)
@@ -91,7 +306,7 @@ class ModBot(discord.Client):
         if message.content == Report.HELP_KEYWORD:
             reply =  "Use the `report` command to begin the reporting process.\n"
             reply += "Use the `cancel` command to cancel the report process.\n"
-            await message.channel.send(reply)
+            await self.dispatcher.send(message.channel, reply)
             return
 
         author_id = message.author.id
@@ -104,6 +319,7 @@ class ModBot(discord.Client):
         # If we don't currently have an active report for this user, add one
         if author_id not in self.reports:
             self.reports[author_id] = Report(self)
+            self.sweeper.track("report", author_id)
 
         # Let the report class handle this message; forward all the messages it returns to uss
         responses = await self.reports[author_id].handle_message(message)
@@ -112,9 +328,11 @@ class ModBot(discord.Client):
             #       and updating the report
             if len(r) == 2:
                 msg, view = r
-                await message.channel.send(msg, view=view)
+                sent = self.dispatcher.send(message.channel, msg, view=view)
             else:
-                await message.channel.send(r)
+                sent = self.dispatcher.send(message.channel, r, coalesce=True)
+        if responses:
+            await sent
 
         # If the report is complete or cancelled, remove it from our map
         if self.reports[author_id].report_end():
@@ -122,13 +340,14 @@ class ModBot(discord.Client):
 
             # If the report is complete, save it to list of reports for mod to review
             if report.report_complete():
-                # TODO: implementsomething more sophisticated that scales better for sorting
-                self.submitted_reports.append(report)
-                self.submitted_reports.sort(reverse=True)
+                # Only the compact ID-based record is kept, the Discord objects are let go
+                record = report.to_record()
+                group = self.submitted_reports.add(record)
+                under_review = self.submitted_reports.holder(group.get_report_id()) is not None
+                self.report_store.save(record, IN_REVIEW if under_review else PENDING)
 
                 # Notify the mod channel that a new report has been submitted
-                mod_channel = self.mod_channels[report.message.guild.id]
-                await mod_channel.send(f"Received new report.")
+                await self.notify_report_group(group)
                 
 
             # Also send the message to the mod channel with all details
@@ -141,55 +360,116 @@ class ModBot(discord.Client):
             # Forward the message to the mod channel
             mod_channel = self.mod_channels[message.guild.id]
             #await mod_channel.send(f'Forwarded message:\n{message.author.name}: "{message.content}"')
-            data_payload = self.eval_text(message.content)
-
-            base_msg = f'New post by user `{message.author.name}`\n"{message.content}"\n\n'
-            aux_msgs = self.code_format(data_payload)
-
-            await mod_channel.send(base_msg)
-            for msg in aux_msgs:
-                if msg == "-DELETE-":
-                    await message.delete()
-                    continue
-                await mod_channel.send(msg)
+            author, post = message.author.name, message.content
+
+            # Moderators see the post right away, the summary is edited in place as each signal arrives
+            if not self.models_ready.is_set():
+                # Held until the models are loaded, in arrival order
+                summary = self.dispatcher.send(mod_channel, self.format_summary(author, post, "*Queued, the models are still loading...*"))
+                self.queued_posts += 1
+                try:
+                    await self.models_ready.wait()
+                finally:
+                    self.queued_posts -= 1
+                self.dispatcher.edit(mod_channel, summary, self.format_summary(author, post, "*Evaluating...*"))
+            else:
+                summary = self.dispatcher.send(mod_channel, self.format_summary(author, post, "*Evaluating...*"))
+            delete_attempted = False
+            deleted = False
+
+            async def show(data_payload):
+                nonlocal delete_attempted, deleted
+                aux_msgs = self.code_format(data_payload)
+                # The post is removed as soon as the verdict can't change anymore, see code_format
+                if "-DELETE-" in aux_msgs and not delete_attempted:
+                    delete_attempted = True
+                    try:
+                        await message.delete()
+                        deleted = True
+                    except discord.errors.NotFound:
+                        deleted = True
+                    except discord.HTTPException as e:
+                        # Runs inside the fan-out, an exception here would abandon the other providers
+                        print(f"Removing post {message.id} failed: {e}")
+                verdict = [msg for msg in aux_msgs[1:] if msg not in ("-DELETE-", self.REMOVED_POST_MSG)]
+                if deleted:
+                    # A later update can't bring the post back, the summary keeps saying it is gone
+                    verdict.append(self.REMOVED_POST_MSG)
+                elif delete_attempted:
+                    verdict.append(self.REMOVE_FAILED_MSG)
+                self.dispatcher.edit(mod_channel, summary, self.format_summary(author, post, aux_msgs[0], "\n".join(verdict)))
+
+            await show(await self.eval_text(message.content, message.jump_url, on_update=show))
 
         elif message.channel.name == f'group-{self.group_num}-mod':
-            # TODO: implement locks to allow multiple mods to review at the same time
+            # Several moderators can review at once, each one holds a lease on the report they claimed
             mod_channel = self.mod_channels[message.guild.id]
+            author_id = message.author.id
 
-            if message.content == ModReview.LIST_REPORTS:
-                reports_msg = ModReview.list_reports(self.submitted_reports)
-                await mod_channel.send(reports_msg)
+            if message.content.split(maxsplit=1)[:1] == [ModReview.LIST_REPORTS]:
+                reports_msg = ModReview.list_reports(self.submitted_reports, message.content)
+                await self.dispatcher.send(mod_channel, reports_msg)
 
-            elif message.content == ModReview.REVIEW_URGENT_REPORT:
+            elif message.content == ModReview.REVIEW_URGENT_REPORT or message.content.startswith(ModReview.REVIEW_REPORT):
                 # For now, each moderator can only review one report at a time and
                 # there is no customer interaction
-                
-                author_id = message.author.id
-                if author_id not in self.mod_review:
+                if author_id in self.mod_review:
+                    await self.dispatcher.send(mod_channel, "A moderator can only review one report at a time.")
+                    return
+
+                if message.content == ModReview.REVIEW_URGENT_REPORT:
                     # Take the most urgent report and review it
-                    most_urgent = self.submitted_reports.pop(0)
-                    self.mod_review[author_id] = ModReview(self, most_urgent)
-                    # Start the moderator flow using drop down boxes
-
-                    responses = await self.mod_review[author_id].handle_message(message)
-                    for r in responses:
-                        if len(r) == 2:
-                            msg, view = r
-                            await message.channel.send(msg, view=view)
-                        else:
-                            await message.channel.send(r)
+                    report = self.submitted_reports.claim_next(author_id)
+                    if report is None:
+                        await self.dispatcher.send(mod_channel, "There are no reports to review at this time!")
+                        return
                 else:
-                    await mod_channel.send("A moderator can only review one report at a time.")
+                    report_id = message.content[len(ModReview.REVIEW_REPORT):].strip()
+                    report = self.submitted_reports.claim(report_id, author_id)
+                    if report is None:
+                        await self.dispatcher.send(mod_channel, f"Report `{report_id}` doesn't exist or is already being reviewed.")
+                        return
+
+                self.report_store.set_status(report.get_report_ids(), IN_REVIEW)
+                self.mod_review[author_id] = ModReview(self, report, author_id)
+                self.sweeper.track("review", author_id)
+
+                # Start the moderator flow using drop down boxes
+                responses = await self.mod_review[author_id].handle_message(message)
+                for r in responses:
+                    if len(r) == 2:
+                        msg, view = r
+                        sent = self.dispatcher.send(message.channel, msg, view=view)
+                    else:
+                        sent = self.dispatcher.send(message.channel, r, coalesce=True)
+                if responses:
+                    await sent
 
             elif message.content == ModReview.REVIEW_DONE:
-
-                author_id = message.author.id
                 if author_id in self.mod_review:
                     finished_report = self.mod_review.pop(author_id)
-                    await message.channel.send(f"Report {finished_report.report.get_report_id()} is finished with review")
+                    report_id = finished_report.report.get_report_id()
+                    # Unless the lease lapsed and another moderator has taken over the report
+                    if self.submitted_reports.holder(report_id) in (author_id, None):
+                        self.submitted_reports.complete(report_id)
+                        self.submitted_reports.remove(report_id)
+                        self.report_store.set_status(finished_report.report.get_report_ids(), DONE)
+                        self.group_notifications.pop(report_id, None)
+                    await self.dispatcher.send(message.channel, f"Report {finished_report.report.get_report_id()} is finished with review")
                 else:
-                    await message.channel.send("You don't have any active reports being reviewed") 
+                    await self.dispatcher.send(message.channel, "You don't have any active reports being reviewed") 
+
+            elif message.content == ModReview.REVIEW_RELEASE:
+                if author_id in self.mod_review:
+                    released = self.mod_review.pop(author_id)
+                    self.submitted_reports.release(released.report.get_report_id())
+                    self.report_store.set_status(released.report.get_report_ids(), PENDING)
+                    await self.dispatcher.send(message.channel, f"Report {released.report.get_report_id()} is back in the backlog")
+                else:
+                    await self.dispatcher.send(message.channel, "You don't have any active reports being reviewed") 
+
+            elif message.content == ModReview.BOT_STATS:
+                await self.dispatcher.send(mod_channel, self.get_stats())
 
             else:
                 # Check 
@@ -198,24 +478,132 @@ class ModBot(discord.Client):
         return
 
     
-    def eval_text(self, message):
+    async def eval_text(self, message, url=None, on_update=None):
+        # Identical posts (ignoring case and spacing) are answered from the cache
+        key = text_key(message)
+        # With EVAL_CACHE_PATH a memory miss reads SQLite, kept off the event loop like the writes below
+        data_payload = await run_io(self.eval_cache.get, key)
+        if data_payload is not None:
+            return data_payload
+
+        # Paraphrased posts reuse the verdict of the most similar post we already evaluated
+        emb = None
+        if get_model_registry().is_enabled(EMBEDDING_MODEL):
+            try:
+                emb = await run_blocking(self.text_analysis.embed, message)
+                matches = await run_blocking(self.recent_posts.search, emb, 1)
+            except Exception as e:
+                # Dedup is only a shortcut, the post still gets a full evaluation
+                print(f"Near-duplicate lookup failed: {e}")
+                emb, matches = None, []
+            if matches and matches[0][0] >= self.dedup_similarity:
+                sim, earlier = matches[0]
+                data_payload = {**earlier["payload"], "duplicate_of": earlier["url"], "duplicate_sim": sim}
+                await run_io(self.eval_cache.set, key, data_payload)
+                return data_payload
+
+        data_payload = await self._run_classifiers(message, on_update)
+
+        # Don't remember a failed evaluation, the next repost should try again
+        if data_payload["llm_reason"] != OPENAI_FAILED_MSG and "unavailable" not in data_payload:
+            await run_io(self.eval_cache.set, key, data_payload)
+            if emb is not None:
+                try:
+                    # Flushes the memory map and appends to its log, kept off the event loop
+                    await run_blocking(self.recent_posts.add, emb, {"payload": data_payload, "url": url})
+                except Exception as e:
+                    print(f"Adding the post to the near-duplicate index failed: {e}")
+        return data_payload
+
+    async def _run_classifiers(self, message, on_update=None):
+        '''
+        Everything in here is awaited so that a slow classification never blocks the gateway. 
+        Network calls are async and model inference runs on the bounded executor in apis.helper.
+        If given, on_update is awaited with a partial payload every time a provider finishes.
+        '''
+        async def on_result(results, failed, pending):
+            if pending:
+                await on_update(self._build_payload(results, failed, pending))
+
+        results, failed = await self.fanout.run(message, on_result=on_result if on_update else None)
+        return self._build_payload(results, failed)
+
+    def _build_payload(self, results, failed, pending=()):
         data_payload = {}
         # Check if its misinformation via OpenAI
-        conclusion, reason = self.openai.misinfo_detection(message)
+        if "llm" in results:
+            conclusion, reason, misinfo_type = results["llm"]
+        elif "llm" in pending:
+            conclusion, reason, misinfo_type = WAITING, "Waiting for the LLM", None
+        else:
+            conclusion, reason, misinfo_type = UNAVAILABLE, "The LLM is currently unavailable", None
         data_payload["llm_result"] = conclusion
         data_payload["llm_reason"] = reason
-        if conclusion == MISINFO:
-            misinfo_type = self.openai.get_misinfo_type(message)
+        if misinfo_type is not None:
             data_payload["llm_result_type"] = misinfo_type
 
-        # Check if its misinformation via Google Fact Check API
-        #conclusion, similar_msgs = self.claimbuster.get_matching_facts(message)
-        conclusion, similar_msgs = self.googlefactcheck.get_matching_facts(message)
+        # Merge every fact check provider that answered in time
+        fact_checks = [results[name] for name in self.fact_check_providers if name in results]
+        conclusion, similar_msgs = merge_fact_checks(fact_checks)
+        if not fact_checks:
+            if any(name in pending for name in self.fact_check_providers):
+                conclusion, similar_msgs = WAITING, [{"formatted_msg": "Waiting for the fact check providers"}]
+            else:
+                conclusion, similar_msgs = UNAVAILABLE, [{"formatted_msg": "No fact check provider is currently available"}]
         data_payload["crowd_source_result"] = conclusion
         data_payload["crowd_source_examples"] = similar_msgs
 
+        if failed:
+            data_payload["unavailable"] = list(failed)
+        if pending:
+            data_payload["pending"] = sorted(pending)
         return data_payload
 
+    async def _llm_signal(self, message):
+        # One LLM call returns the conclusion, reason and misinformation type together,
+        # shared with any other posts that arrived within the batching window
+        return await self.llm_batcher.submit(message)
+
+
+    def get_stats(self):
+        lines = ["**Startup**: " + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in self.startup_phases.items())]
+        if not self.models_ready.is_set():
+            lines.append(f"**Models still loading**: {self.queued_posts} posts queued")
+        lines.append("**Loaded models**:")
+        memory = get_model_registry().memory_usage()
+        for name, nbytes in memory.items():
+            lines.append(f"• {name}: {nbytes / 2**20:.1f} MB")
+        if not memory:
+            lines.append("• none yet")
+
+        stats = self.eval_cache.stats()
+        lines.append(f"**Eval cache**: {stats['size']} entries, {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+        for name, breaker in self.fanout.breakers.items():
+            stats = breaker.stats()
+            lines.append(f"**{name} circuit**: {stats['state']}, {stats['trips']} trips, {stats['recent_errors']}/{stats['recent_calls']} recent calls failed")
+        for name, skipped in self.fanout.skipped.items():
+            lines.append(f"**{name}**: not needed for {skipped} posts, {self.fanout.fallbacks[name][0]} already had similar fact checks")
+
+        for kind, counts in self.sweeper.stats().items():
+            lines.append(f"**{kind.capitalize()} sessions**: {counts['live']} live, {counts['expired']} expired")
+
+        stats = self.llm_batcher.stats()
+        lines.append(f"**LLM batching**: {stats['items']} posts in {stats['batches']} requests ({stats['avg_batch_size']:.1f} per request)")
+        lines.append(f"**Local fact checks**: {len(self.localfactcheck)} stored claims")
+        stats = self.text_analysis.entailment_cache.stats()
+        lines.append(f"**Entailment cache**: {stats['size']} inputs, {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+                     f"{self.text_analysis.short_circuits} ratings decided by the contradiction regex")
+        if self.text_analysis.embedding_cache is not None:
+            stats = self.text_analysis.embedding_cache.stats()
+            lines.append(f"**Embedding cache**: {stats['size']} texts, {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)"
+                         + (f", {stats['skipped']} not cached (dimension mismatch)" if stats['skipped'] else ""))
+        lines.append(f"**Near-duplicate index**: {len(self.recent_posts)} recent posts")
+
+        stats = self.dispatcher.stats()
+        lines.append(f"**Send queue**: {stats['depth']} waiting (max {stats['max_depth']} in one channel), {stats['queued']} queued as "
+                     f"{stats['sent']} messages, {stats['failed']} failed, latency {stats['avg_latency']:.2f}s avg / {stats['p95_latency']:.2f}s p95")
+        return "\n".join(lines)
+
     
     def code_format(self, payload):
         ''''
@@ -225,27 +613,61 @@ class ModBot(discord.Client):
         '''
         all_text = []
 
-        text = f"**LLM conclusion**: {payload['llm_result']}\n**LLM reason**: {payload['llm_reason']}\n"
+        text = ""
+        if "duplicate_of" in payload:
+            text += f"**Near-duplicate** ({payload['duplicate_sim']:.2f} similarity) of an already evaluated post, reusing its verdict: {payload['duplicate_of']}\n"
+
+        text += f"**LLM conclusion**: {payload['llm_result']}\n**LLM reason**: {payload['llm_reason']}\n"
         if "llm_result_type" in payload:
             text += f"**LLM Misinformation Type**: {payload['llm_result_type']}\n"
 
-        text += f"**Crowd Source Fact Check conclusion**: {payload['crowd_source_result']}\nHere are similar fact-checked statements from Google FactCheck API that support this decision: \n"
+        text += f"**Crowd Source Fact Check conclusion**: {payload['crowd_source_result']}\nHere are similar fact-checked statements that support this decision: \n"
         for example in payload["crowd_source_examples"]:
             text += f"• {example['formatted_msg']}\n"
+        if "unavailable" in payload:
+            text += f"*Unavailable signals (failed, timed out or circuit open): {', '.join(payload['unavailable'])}*\n"
+        if "pending" in payload:
+            text += f"*Still waiting for: {', '.join(payload['pending'])}*\n"
 
         all_text.append(text)
 
         aux_info = ""
-        if payload['llm_result'] == payload['crowd_source_result']:
+        if payload['llm_result'] == payload['crowd_source_result'] and payload['llm_result'] not in (UNAVAILABLE, WAITING):
             all_text.append(f"\nThis post is likely {payload['llm_result']} based on agreement between multiple sources.")
-            if payload['llm_result'] == MISINFO:
+            # Removal can't be undone, so it waits until no pending fact check can change the merged conclusion
+            fact_checks_pending = any(name in payload.get("pending", ()) for name in self.fact_check_providers)
+            if payload['llm_result'] == MISINFO and "duplicate_of" in payload:
+                # Embeddings barely see negation, a reused verdict never removes a post on its own
+                all_text.append("*Not removed automatically since the verdict was reused from a similar post, please check it*")
+            elif payload['llm_result'] == MISINFO and not fact_checks_pending:
                 all_text.append("-DELETE-")
-                all_text.append(f"*Remove offending post*")
+                all_text.append(self.REMOVED_POST_MSG)
+        elif "pending" in payload:
+            all_text.append(f"\nThe remaining signals are still being evaluated.")
         else:
             all_text.append(f"\nIt is unclear whether this post is misinformation, please evaluate as necessary.")
 
         return all_text
 
+    def format_summary(self, author, post, details, verdict=""):
+        '''
+        The mod channel summary of a post. It is edited in place so it has to stay one message: the
+        quoted post is shortened first, then the signal details, the verdict always fits.
+        '''
+        def shorten(text, length):
+            return text if len(text) <= length else text[:max(0, length - 1)] + "…"
+
+        def build():
+            return f'New post by user `{author}`\n"{post}"\n\n{details}' + (f"\n{verdict}" if verdict else "")
+
+        overflow = len(build()) - MAX_MESSAGE_LENGTH
+        if overflow > 0:
+            post = shorten(post, max(self.POST_PREVIEW_LENGTH, len(post) - overflow))
+            overflow = len(build()) - MAX_MESSAGE_LENGTH
+        if overflow > 0:
+            details = shorten(details, len(details) - overflow)
+        return build()
+
 
 client = ModBot()
 client.run(discord_token)
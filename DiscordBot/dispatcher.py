@@ -0,0 +1,177 @@
+import asyncio
+import time
+import weakref
+from collections import deque
+
+
+# Discord rejects messages longer than this
+MAX_MESSAGE_LENGTH = 2000
+
+
+def split_message(content, limit=MAX_MESSAGE_LENGTH):
+    '''
+    Splits text into chunks Discord accepts, preferring to break between lines.
+    '''
+    chunks = []
+    while len(content) > limit:
+        cut = content.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(content[:cut])
+        content = content[cut:].lstrip("\n")
+    chunks.append(content)
+    return chunks
+
+
+class Outgoing:
+    # A queued send, or an edit when target is set
+    __slots__ = ("channel", "content", "kwargs", "future", "queued_at", "target", "coalesce")
+
+    def __init__(self, channel, content, kwargs, future, target=None, coalesce=False):
+        self.channel = channel
+        self.content = content
+        self.kwargs = kwargs
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.target = target
+        self.coalesce = coalesce and target is None and not kwargs and bool(content)
+
+
+class SendDispatcher:
+    '''
+    All outbound messages go through here. Each channel has its own queue and a single worker,
+    so messages arrive in the order they were queued, and a token bucket per channel keeps us
+    under Discord's per-channel rate limit instead of running into 429s. Plain text messages
+    sent with coalesce=True that are queued behind each other for the same channel are merged
+    into one message as long as they fit, and queued edits of the same message collapse into
+    the latest one. A merged message holds other text, so those sends can't be edited.
+    '''
+
+    def __init__(self, rate=5, per=5.0, latency_window=200):
+        self.rate = rate
+        self.per = per
+        self.queues = {} # Map from channel IDs to pending Outgoing messages
+        self.workers = {} # Map from channel IDs to the task draining their queue
+        self.buckets = {} # Map from channel IDs to (tokens, last refill)
+        self.latencies = deque(maxlen=latency_window)
+        self.coalescable = weakref.WeakSet() # Futures of sends that may be merged with others
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+
+    def send(self, channel, content=None, coalesce=False, **kwargs):
+        '''
+        Queues a message and returns a future for the sent discord.Message (None if sending failed).
+        Text over Discord's length limit is sent as several messages, the future is for the last one.
+        Notices that are never edited can pass coalesce=True to share a message with the ones queued
+        around them.
+        '''
+        loop = asyncio.get_running_loop()
+        queue = self.queues.setdefault(channel.id, deque())
+        chunks = split_message(content) if content else [content]
+        for ind, chunk in enumerate(chunks):
+            future = loop.create_future()
+            queue.append(Outgoing(channel, chunk, kwargs if ind == len(chunks) - 1 else {}, future, coalesce=coalesce))
+            if coalesce:
+                self.coalescable.add(future)
+            self.queued += 1
+        self._start(channel.id)
+        return future
+
+    def edit(self, channel, message, content):
+        '''
+        Queues an edit of a message in channel. message can also be the future returned by send, the
+        edit then goes out once the message exists. Returns a future for the edited message.
+        '''
+        if message in self.coalescable:
+            raise ValueError("Messages sent with coalesce=True may hold other text and can't be edited")
+        queue = self.queues.setdefault(channel.id, deque())
+        content = split_message(content)[0]
+        for outgoing in queue:
+            if outgoing.target is message:
+                # An older edit hasn't gone out yet, it just gets the newer content
+                outgoing.content = content
+                return outgoing.future
+        future = asyncio.get_running_loop().create_future()
+        queue.append(Outgoing(channel, content, {}, future, target=message))
+        self.queued += 1
+        self._start(channel.id)
+        return future
+
+    def _start(self, channel_id):
+        if channel_id not in self.workers:
+            self.workers[channel_id] = asyncio.create_task(self._drain(channel_id))
+
+    async def _acquire(self, channel_id):
+        tokens, last = self.buckets.get(channel_id, (self.rate, time.monotonic()))
+        while True:
+            now = time.monotonic()
+            tokens = min(self.rate, tokens + (now - last) * self.rate / self.per)
+            last = now
+            if tokens >= 1:
+                self.buckets[channel_id] = (tokens - 1, last)
+                return
+            await asyncio.sleep((1 - tokens) * self.per / self.rate)
+
+    def _next_batch(self, queue):
+        # Takes the next message plus any plain text queued right behind it that still fits
+        batch = [queue.popleft()]
+        length = len(batch[0].content or "")
+        while batch[0].coalesce and queue and queue[0].coalesce and length + 1 + len(queue[0].content) <= MAX_MESSAGE_LENGTH:
+            length += 1 + len(queue[0].content)
+            batch.append(queue.popleft())
+        return batch
+
+    async def _drain(self, channel_id):
+        queue = self.queues[channel_id]
+        try:
+            while queue:
+                batch = self._next_batch(queue)
+                first = batch[0]
+                content = "\n".join(outgoing.content for outgoing in batch) if len(batch) > 1 else first.content
+                message = await self._deliver(first.channel, content, first.kwargs, first.target)
+                now = time.monotonic()
+                for outgoing in batch:
+                    self.latencies.append(now - outgoing.queued_at)
+                    if not outgoing.future.done():
+                        outgoing.future.set_result(message)
+        finally:
+            del self.workers[channel_id]
+            if not queue:
+                del self.queues[channel_id]
+
+    async def _deliver(self, channel, content, kwargs, target):
+        if isinstance(target, asyncio.Future):
+            # Queued behind the send that creates it, so this doesn't wait
+            target = await target
+            if target is None:
+                self.failed += 1
+                return None
+        await self._acquire(channel.id)
+        try:
+            if target is None:
+                message = await channel.send(content, **kwargs)
+            else:
+                message = await target.edit(content=content)
+            self.sent += 1
+            return message
+        except Exception as e:
+            print(f"Sending to channel {channel.id} failed: {e}")
+            self.failed += 1
+            return None
+
+    async def close(self):
+        for worker in list(self.workers.values()):
+            worker.cancel()
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "depth": sum(len(queue) for queue in self.queues.values()),
+            "max_depth": max([len(queue) for queue in self.queues.values()], default=0),
+            "avg_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p95_latency": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+        }
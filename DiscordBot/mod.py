@@ -1,17 +1,18 @@
 from enum import Enum, auto
+import time
 import discord
 
-from datetime import timedelta
+from datetime import datetime, timedelta
 delta = timedelta(
     days=0,
     seconds=27
 )
 
 from report import ReportView, ReportDropdown
+from store import IN_REVIEW
 # TODO: move these to constants.py folder
-from report import (GENERIC_YES, GENERIC_NO, REPORTING_USER_ID, 
-                    REPORTED_POST_URL, REPORTED_USER_ID, REPORTED_MESSAGE,
-                    IMPOSTER_PROMPT, FAKE_PERSON)
+from report import (GENERIC_YES, GENERIC_NO, IMPOSTER_PROMPT, FAKE_PERSON,
+                    MANIPULATED_CONTENT, FAKE_CONTENT, IMPOSTER_CONTENT, OUT_OF_CONTEXT)
 
 
 # System Prompts
@@ -21,7 +22,15 @@ ADVERSARIAL_PROMPT = "Is the report an adversarial user report?"
 IMMEDIATE_DANGER_PROMPT = "Does this post pose an immediate threat via potential to cause harm?"
 REPEAT_OFFENDER_PROMPT = "Does the account being reported have a history of 3 or more violations?"
 
+# list-reports paging, a page has to fit in one Discord message (2000 characters)
+LIST_REPORTS_USAGE = "list-reports [sev=MIN-MAX] [from=YYYY-MM-DD] [to=YYYY-MM-DD] [reporter=ID] [reported=ID] [type=NAME] [limit=N] [after=CURSOR]"
+ABUSE_TYPES = [MANIPULATED_CONTENT, FAKE_CONTENT, IMPOSTER_CONTENT, OUT_OF_CONTEXT]
+DEFAULT_PAGE_SIZE = 15
+MAX_PAGE_SIZE = 25
+PAGE_BUDGET = 1700
+
 # System warnings
+LEASE_LOST_MSG = "This review was idle for too long and the report was picked up by another moderator. Type `finish-report` to close it."
 
 class ReviewState(Enum):
     REVIEW_START = auto()
@@ -32,37 +41,127 @@ class ModReview:
     LIST_REPORTS = "list-reports"
     REVIEW_URGENT_REPORT = "review-urgent-report"
     REVIEW_DONE = "finish-report"
+    REVIEW_RELEASE = "release-report"
+    BOT_STATS = "bot-stats"
 
-    # TODO: allow for review of arbitrary report where the UUID of the report is specified
+    # Review of an arbitrary report where the UUID of the report is specified, e.g. `review-report <UUID>`
     REVIEW_REPORT = "review-report"
 
-    def __init__(self, client, report):
+    def __init__(self, client, report, moderator_id):
         self.client = client
         self.report = report
+        self.moderator_id = moderator_id
         self.review_status = ReviewState.REVIEW_START
         self.channel = None
+        self.last_active = time.monotonic()
+
+    def touch(self):
+        '''
+        Any activity keeps the review session alive and renews the claim on the report. If the lease
+        already ran out, the report is claimed again unless another moderator has taken it since, or
+        this session itself has expired (e.g. a click on an old view).
+        '''
+        self.last_active = time.monotonic()
+        backlog = self.client.submitted_reports
+        report_id = self.report.get_report_id()
+        if backlog.renew(report_id, self.moderator_id):
+            return True
+        if self.client.mod_review.get(self.moderator_id) is not self:
+            return False
+        if backlog.claim(report_id, self.moderator_id) is None:
+            return False
+        self.client.report_store.set_status(self.report.get_report_ids(), IN_REVIEW)
+        return True
  
     @staticmethod
-    def list_reports(reports):
-        all_reports = ""
-        for ind, report in enumerate(reports):
-            all_reports += f"(#{ind}) -- **ID**: {report.get_report_id()}, **Sev**: {report.get_report_severity()}, **Date**: {report.get_report_date()}\n"
+    def list_reports(backlog, command=LIST_REPORTS):
+        '''
+        Handles `list-reports [sev=MIN-MAX] [from=YYYY-MM-DD] [to=YYYY-MM-DD] [reporter=ID] [reported=ID]
+        [type=NAME] [limit=N] [after=CURSOR]`. Pages stay under Discord's message limit and end with 
+        the command for the next page.
+        '''
+        try:
+            filters, limit, after = ModReview._parse_list_args(command[len(ModReview.LIST_REPORTS):].split())
+        except ValueError as e:
+            return f"{e}\nUsage: `{LIST_REPORTS_USAGE}`"
+
+        reports = backlog.query(after=after, limit=limit + 1, **filters)
+        all_reports = []
+        length = 0
+        for report in reports[:limit]:
+            line = f"**ID**: {report.get_report_id()}, **Sev**: {report.get_group_severity()}, **Date**: {report.get_report_date()}"
+            if report.duplicates:
+                line += f", **Reports**: {report.get_report_count()}"
+            if length + len(line) + 1 > PAGE_BUDGET:
+                break
+            all_reports.append(line)
+            length += len(line) + 1
+        shown = len(all_reports)
+
         if not all_reports:
-            all_reports = "There are no reports to review at this time!"
-        return all_reports
+            all_reports.append("There are no reports to review at this time!")
+        if backlog.leases:
+            all_reports.append(f"({len(backlog.leases)} reports are currently being reviewed)")
+        if 0 < shown < len(reports):
+            last = reports[shown - 1]
+            (neg_severity, timestamp) = last.get_priority_key()
+            args = [arg for arg in command.split()[1:] if not arg.startswith("after=")]
+            next_command = " ".join([ModReview.LIST_REPORTS] + args + [f"after={-neg_severity}:{timestamp}:{last.get_report_id()}"])
+            all_reports.append(f"Next page: `{next_command}`")
+        return "\n".join(all_reports)
+
+    @staticmethod
+    def _parse_list_args(args):
+        filters = {}
+        limit = DEFAULT_PAGE_SIZE
+        after = None
+        for arg in args:
+            key, _, value = arg.partition("=")
+            if not value:
+                raise ValueError(f"Could not read `{arg}`.")
+            if key == "sev":
+                # sev=3 is exactly 3, sev=3- is 3 and up, sev=-3 is up to 3
+                low, dash, high = value.partition("-")
+                filters["min_severity"] = int(low) if low else None
+                filters["max_severity"] = int(high) if high else (None if dash else filters["min_severity"])
+            elif key == "from":
+                filters["since"] = datetime.strptime(value, "%Y-%m-%d").timestamp()
+            elif key == "to":
+                filters["until"] = (datetime.strptime(value, "%Y-%m-%d") + timedelta(days=1)).timestamp()
+            elif key == "reporter":
+                filters["reporting_user"] = int(value.strip("<@!>"))
+            elif key == "reported":
+                filters["reported_user"] = int(value.strip("<@!>"))
+            elif key == "type":
+                matches = [abuse_type for abuse_type in ABUSE_TYPES if abuse_type.lower().startswith(value.lower())]
+                if not matches:
+                    raise ValueError(f"Unknown abuse type `{value}`, use one of: {', '.join(ABUSE_TYPES)}.")
+                filters["abuse_type"] = matches[0]
+            elif key == "limit":
+                limit = max(1, min(int(value), MAX_PAGE_SIZE))
+            elif key == "after":
+                severity, timestamp, report_id = value.split(":", 2)
+                after = ((-int(severity), float(timestamp)), report_id)
+            else:
+                raise ValueError(f"Unknown filter `{key}`.")
+        return filters, limit, after
 
 
     async def handle_message(self, message):
+        if not self.touch():
+            return [LEASE_LOST_MSG]
 
         yes_no_select_options = [
             (GENERIC_YES, ""),
             (GENERIC_NO, "")
         ]
-        if message.content == self.REVIEW_URGENT_REPORT:
+        if message.content == self.REVIEW_URGENT_REPORT or message.content.startswith(self.REVIEW_REPORT):
             # Print out the full report
             self.channel = message.channel
+            # The reported message and users are only fetched now that a moderator needs them
+            await self.report.resolve(self.client)
             full_report = self.report.get_formatted_report()
-            await message.channel.send(f"This is the full report transcript:\n\n {full_report}")
+            await self.client.dispatcher.send(message.channel, f"This is the full report transcript:\n\n {full_report}")
             
             return [(ACCURATE_LINK_PROMPT, ReportView(yes_no_select_options, ACCURATE_LINK_PROMPT, self._handle_report_type))]
             
@@ -70,6 +169,8 @@ class ModReview:
     
     
     async def _handle_report_type(self, prompt, payload):
+        if not self.touch():
+            return [LEASE_LOST_MSG]
         yes_no_select_options = [
             (GENERIC_YES, ""),
             (GENERIC_NO, "")
@@ -78,22 +179,27 @@ class ModReview:
         if prompt == ACCURATE_LINK_PROMPT:
             if payload == GENERIC_NO:
                 # TODO: Implement warn the user -> DONE
-                if IMPOSTER_PROMPT in self.report.report_info and self.report.report_info[IMPOSTER_PROMPT] == FAKE_PERSON:
+                if self.report.get_answer(IMPOSTER_PROMPT) == FAKE_PERSON:
                     pass
                 else:
-                    await self.report.report_info[REPORTING_USER_ID].send(f"""
+                    # None if the account was deleted, see ReportRecord.resolve
+                    if self.report.reporting_user is not None:
+                        await self.client.dispatcher.send(self.report.reporting_user, f"""
                     Please try to provide pertinent information while reporting misinformation. 
-                    This message is in response to your report {self.report.report_info[REPORTED_POST_URL]}.
+                    This message is in response to your report {self.report.get_post_url()}.
                     """)
-                    await self.channel.send(f"*Warn offending user*")
+                    await self.client.dispatcher.send(self.channel, f"*Warn offending user*", coalesce=True)
                 
             return [(MISINFO_VIOLATION_PROMPT, ReportView(yes_no_select_options, MISINFO_VIOLATION_PROMPT, self._handle_report_type))]
 
         if prompt == MISINFO_VIOLATION_PROMPT:
             if payload == GENERIC_YES:
                 # TODO: remove the post -> DONE
-                await self.report.report_info[REPORTED_MESSAGE].delete()
-                await self.channel.send(f"*Remove offending post*")
+                if self.report.message is not None:
+                    await self.report.message.delete()
+                    await self.client.dispatcher.send(self.channel, f"*Remove offending post*", coalesce=True)
+                else:
+                    await self.client.dispatcher.send(self.channel, f"*Post was already removed*", coalesce=True)
                 return [(IMMEDIATE_DANGER_PROMPT, ReportView(yes_no_select_options, IMMEDIATE_DANGER_PROMPT, self._handle_report_type))]
             elif payload == GENERIC_NO:
                 return [(ADVERSARIAL_PROMPT, ReportView(yes_no_select_options, ADVERSARIAL_PROMPT, self._handle_report_type))]
@@ -101,7 +207,7 @@ class ModReview:
         if prompt == ADVERSARIAL_PROMPT:
             if payload == GENERIC_YES:
                 # TODO: temporary ban on reporting
-                await self.channel.send(f"*Temp ban on reporting*")
+                await self.client.dispatcher.send(self.channel, f"*Temp ban on reporting*", coalesce=True)
             elif payload == GENERIC_NO:
                 # No further action
                 pass
@@ -111,10 +217,10 @@ class ModReview:
                 # TODO: report to law enforcement
                 # TODO: ban account
 
-                # await self.report.report_info[REPORTED_MESSAGE].delete()
+                # await self.report.message.delete()
 
-                await self.channel.send(f"*Report to law enforcement*")
-                await self.channel.send(f"*Ban account*")
+                await self.client.dispatcher.send(self.channel, f"*Report to law enforcement*", coalesce=True)
+                await self.client.dispatcher.send(self.channel, f"*Ban account*", coalesce=True)
     
             elif payload == GENERIC_NO:
                 return [(REPEAT_OFFENDER_PROMPT, ReportView(yes_no_select_options, REPEAT_OFFENDER_PROMPT, self._handle_report_type))]
@@ -123,16 +229,17 @@ class ModReview:
             if payload == GENERIC_YES:
                 # TODO: ban reported account
                 # reason = "Your account was reported >= 3 times for misinformation"
-                # await self.report.report_info[REPORTED_USER_ID].ban(reason=reason)
-                # await self.report.report_info[REPORTED_USER_ID].unban(reason=reason)
-                await self.channel.send(f"*Report to law enforcement*")
+                # await self.report.reported_user.ban(reason=reason)
+                # await self.report.reported_user.unban(reason=reason)
+                await self.client.dispatcher.send(self.channel, f"*Report to law enforcement*", coalesce=True)
             elif payload == GENERIC_NO:
                 # TODO: Warn reported account
-                await self.report.report_info[REPORTED_USER_ID].send(f"""
-                Please don't post misinformation on the platform. Your post {self.report.report_info[REPORTED_POST_URL]}
+                if self.report.reported_user is not None:
+                    await self.client.dispatcher.send(self.report.reported_user, f"""
+                Please don't post misinformation on the platform. Your post {self.report.get_post_url()}
                 was reported by another user. Three reports will lead to your account being banned.
                 """)
-                await self.channel.send(f"*Warn account*")
+                await self.client.dispatcher.send(self.channel, f"*Warn account*", coalesce=True)
             
         self.review_status = ReviewState.REVIEW_COMPLETE
         return [(f"Report remediation workflow finished. Type {self.REVIEW_DONE} to finish the report.")]
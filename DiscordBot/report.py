@@ -1,9 +1,10 @@
 from datetime import datetime
 from enum import Enum, auto
-from functools import total_ordering
 from uuid import uuid4
 import json
+import math
 import re
+import time
 
 import discord
 
@@ -55,6 +56,16 @@ REPORTED_POST_URL = "Reported Post URL"
 REPORT_SEVERITY = "Report Severity"
 REPORTED_MESSAGE = "Reported message"
 EVIDENCE_URL = "URL or context as evidence"
+REPORT_COUNT = "Number of Reports"
+OTHER_REPORT_IDS = "Other Report IDs"
+
+# Compact codes for the prompts and answers of the reporting flow, used by ReportRecord
+PROMPTS = [ABUSE_PROMPT, MANIPULATED_PROMPT, COUNTER_EVIDENCE_PROMPT, IMPOSTER_PROMPT, OUT_OF_CONTEXT_PROMPT,
+           REAL_ORG_PROMPT, IMMINENT_DANGER_PROMPT, BLOCK_PROMPT]
+ANSWERS = [GENERIC_YES, GENERIC_NO, MANIPULATED_CONTENT, FAKE_CONTENT, IMPOSTER_CONTENT, OUT_OF_CONTEXT,
+           MOD_ORIG_SOURCE, MISSING_INFO, EXAGGERATION, IMPOSTER, FAKE_PERSON]
+PROMPT_CODES = {prompt: code for code, prompt in enumerate(PROMPTS)}
+ANSWER_CODES = {answer: code for code, answer in enumerate(ANSWERS)}
 
 
 class State(Enum):
@@ -64,7 +75,6 @@ class State(Enum):
     REPORT_CANCELED = auto()
     REPORT_COMPLETE = auto()
     
-@total_ordering
 class Report:
     START_KEYWORD = "report"
     CANCEL_KEYWORD = "cancel"
@@ -79,6 +89,7 @@ class Report:
         self.reporting_stage = None
         self.complete = False
         self.report_severity = 0
+        self.last_active = time.monotonic()
 
         # Every report needs a unique ID
         self.add_to_report(REPORT_ID, uuid4())
@@ -89,6 +100,7 @@ class Report:
         prompts to offer at each of those states. You're welcome to change anything you want; this skeleton is just here to
         get you started and give you a model for working with Discord. 
         '''
+        self.last_active = time.monotonic()
 
         if message.content == self.CANCEL_KEYWORD:
             self.state = State.REPORT_CANCELED
@@ -123,7 +135,7 @@ class Report:
             if not channel:
                 return ["It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."]
             try:
-                message = await channel.fetch_message(int(m.group(3)))
+                message = await self.client.get_reported_message(channel, int(m.group(3)))
             except discord.errors.NotFound:
                 return ["It seems this message was deleted or never existed. Please try again or say `cancel` to cancel."]
 
@@ -166,6 +178,7 @@ class Report:
 
 
     async def _handle_report_type(self, prompt, payload):
+        self.last_active = time.monotonic()
         self.add_to_report(prompt, payload)
 
         yes_no_select_options = [
@@ -286,16 +299,143 @@ class Report:
             raise Exception("This can only be called after a report is complete.")
         return self.report_info.get(REPORTED_USER_ID, None)
 
-    # Order reports based on severity and date
-    def __eq__(self, obj):
-        return (self.report_info[REPORT_SEVERITY] == obj.report_info[REPORT_SEVERITY]) and (self.report_info[REPORT_DATE] == obj.report_info[REPORT_DATE])
+    def to_record(self):
+        '''
+        Compact form of a completed report that only keeps Discord IDs and coded answers.
+        '''
+        if self.state != State.REPORT_COMPLETE:
+            raise Exception("This can only be called after a report is complete.")
+        answers = tuple((PROMPT_CODES[key], ANSWER_CODES[val]) for key, val in self.report_info.items() if key in PROMPT_CODES and val in ANSWER_CODES)
+        return ReportRecord(
+            str(self.report_info[REPORT_ID]),
+            self.message.guild.id,
+            self.message.channel.id,
+            self.message.id,
+            self.report_info[REPORTING_USER_ID].id,
+            self.message.author.id,
+            self.report_severity,
+            self.report_info.get(REPORT_DATE, datetime.now()).timestamp(),
+            answers,
+            self.report_info.get(EVIDENCE_URL)
+        )
+
+
+class ReportRecord:
+    '''
+    A submitted report as it sits in the backlog. Only snowflakes, answer codes and the severity are 
+    kept; the reported message and the users are fetched (and then cached on the record) when a 
+    moderator opens it, see resolve.
+
+    Later reports of the same message are merged into the first one, which then stands for the
+    whole group in the backlog and is reviewed once.
+    '''
+
+    __slots__ = ("id", "guild_id", "channel_id", "message_id", "reporting_user_id", "reported_user_id",
+                 "severity", "timestamp", "answers", "evidence", "message", "reporting_user", "reported_user",
+                 "duplicates")
+
+    def __init__(self, report_id, guild_id, channel_id, message_id, reporting_user_id, reported_user_id, severity, timestamp, answers=(), evidence=None):
+        self.id = report_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.reporting_user_id = reporting_user_id
+        self.reported_user_id = reported_user_id
+        self.severity = severity
+        self.timestamp = timestamp
+        self.answers = answers
+        self.evidence = evidence
+        self.message = None
+        self.reporting_user = None
+        self.reported_user = None
+        self.duplicates = [] # Other reports of the same message
+
+    def merge(self, other):
+        self.duplicates.append(other)
+        self.duplicates.extend(other.duplicates)
+        other.duplicates = []
+
+    def get_report_ids(self):
+        return [self.id] + [duplicate.id for duplicate in self.duplicates]
+
+    def get_reporting_user_ids(self):
+        return {self.reporting_user_id} | {duplicate.reporting_user_id for duplicate in self.duplicates}
+
+    def get_report_count(self):
+        return 1 + len(self.duplicates)
+
+    def get_group_severity(self):
+        # The worst report counts, every doubling of distinct reporters adds one more
+        severity = max([self.severity] + [duplicate.severity for duplicate in self.duplicates])
+        return severity + int(math.log2(len(self.get_reporting_user_ids())))
+
+    async def resolve(self, client):
+        # Whatever can't be fetched any more (deleted channel, post or account) stays None and the
+        # report shows the stored IDs instead, so it can still be reviewed
+        if self.reporting_user is not None:
+            return
+        try:
+            channel = client.get_channel(self.channel_id) or await client.fetch_channel(self.channel_id)
+            self.message = await client.get_reported_message(channel, self.message_id)
+            self.reported_user = self.message.author
+        except discord.HTTPException as e:
+            print(f"Could not fetch the reported post {self.get_post_url()}: {e}")
+        try:
+            if self.reported_user is None:
+                self.reported_user = client.get_user(self.reported_user_id) or await client.fetch_user(self.reported_user_id)
+            self.reporting_user = client.get_user(self.reporting_user_id) or await client.fetch_user(self.reporting_user_id)
+        except discord.HTTPException as e:
+            print(f"Could not fetch the users of report {self.id}: {e}")
+
+    def get_answer(self, prompt):
+        code = PROMPT_CODES[prompt]
+        for prompt_code, answer_code in self.answers:
+            if prompt_code == code:
+                return ANSWERS[answer_code]
+        return None
+
+    def get_post_url(self):
+        return f"https://discord.com/channels/{self.guild_id}/{self.channel_id}/{self.message_id}"
+
+    def get_report_id(self):
+        return self.id
 
-    def __lt__(self, obj):
-        return (self.report_info[REPORT_SEVERITY] < obj.report_info[REPORT_SEVERITY]) and (self.report_info[REPORT_DATE] < obj.report_info[REPORT_DATE])
+    def get_report_date(self):
+        return datetime.fromtimestamp(self.timestamp).strftime("%m/%d/%Y, %H:%M:%S")
+
+    def get_report_severity(self):
+        return self.severity
+
+    def get_reporting_user_id(self):
+        return self.reporting_user_id
+
+    def get_reported_user_id(self):
+        return self.reported_user_id
+
+    def get_formatted_report(self):
+        lines = [
+            f"**{REPORT_ID}**: {self.id}",
+            f"**{REPORTING_USER_ID}**: {self.reporting_user or self.reporting_user_id}",
+            f"**{REPORTED_POST_URL}**: {self.get_post_url()}",
+            f"**{REPORTED_USER_ID}**: {self.reported_user or self.reported_user_id}",
+        ]
+        if self.message is not None:
+            lines.append(f"**{REPORTED_POST}**: {self.message.content}")
+        for prompt_code, answer_code in self.answers:
+            lines.append(f"**{PROMPTS[prompt_code]}**: {ANSWERS[answer_code]}")
+        if self.evidence:
+            lines.append(f"**{EVIDENCE_URL}**: {self.evidence}")
+        lines.append(f"**{REPORT_DATE}**: {self.get_report_date()}")
+        lines.append(f"**{REPORT_SEVERITY}**: {self.severity}")
+        if self.duplicates:
+            lines.append(f"**{REPORT_COUNT}**: {self.get_report_count()} from {len(self.get_reporting_user_ids())} users, combined severity {self.get_group_severity()}")
+            lines.append(f"**{OTHER_REPORT_IDS}**: {', '.join(self.get_report_ids()[1:])}")
+        return "\n".join(lines)
+
+    def get_priority_key(self):
+        # Smallest key is the most urgent: highest severity first, then the oldest report
+        return (-self.get_group_severity(), self.timestamp)
 
-    def __gt__(self, obj):
-        return (self.report_info[REPORT_SEVERITY] > obj.report_info[REPORT_SEVERITY]) and (self.report_info[REPORT_DATE] > obj.report_info[REPORT_DATE])
-        
 
 
 class ReportView(discord.ui.View):
@@ -0,0 +1,76 @@
+import json
+import sqlite3
+from datetime import datetime
+
+from report import ReportRecord
+
+
+PENDING = "pending"
+IN_REVIEW = "in_review"
+DONE = "done"
+
+
+class ReportStore:
+    '''
+    Embedded SQLite store for submitted reports so the moderation backlog survives a restart.
+    Reports are saved as ReportRecords, so only IDs and answer codes are written.
+    '''
+
+    def __init__(self, path="reports.db"):
+        self.conn = sqlite3.connect(path)
+        # WAL keeps the small per-report writes cheap and lets readers run alongside them
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                severity INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                guild_id INTEGER,
+                channel_id INTEGER,
+                message_id INTEGER,
+                reporting_user_id INTEGER,
+                reported_user_id INTEGER,
+                info TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS reports_status ON reports (status)")
+        self.conn.commit()
+
+    def save(self, record, status=PENDING):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO reports (id, status, severity, date, guild_id, channel_id, message_id, reporting_user_id, reported_user_id, info) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (record.id, status, record.severity, datetime.fromtimestamp(record.timestamp).isoformat(), record.guild_id, record.channel_id,
+             record.message_id, record.reporting_user_id, record.reported_user_id,
+             json.dumps({"answers": record.answers, "evidence": record.evidence}))
+        )
+        self.conn.commit()
+
+    def set_status(self, report_ids, status):
+        # Takes every report of a group, see ReportRecord.get_report_ids
+        self.conn.executemany("UPDATE reports SET status = ? WHERE id = ?", [(status, str(report_id)) for report_id in report_ids])
+        self.conn.commit()
+
+    def load_pending(self):
+        '''
+        Returns a ReportRecord for every report that still needs review, read in one query. Reviews that
+        were in progress when the bot stopped go back to pending, their moderator session is gone.
+        '''
+        self.conn.execute("UPDATE reports SET status = ? WHERE status = ?", (PENDING, IN_REVIEW))
+        self.conn.commit()
+        rows = self.conn.execute(
+            "SELECT id, severity, date, guild_id, channel_id, message_id, reporting_user_id, reported_user_id, info "
+            "FROM reports WHERE status = ?", (PENDING,)
+        ).fetchall()
+        records = []
+        for row in rows:
+            info = json.loads(row[8])
+            answers = tuple(tuple(answer) for answer in info.get("answers", []))
+            records.append(ReportRecord(row[0], row[3], row[4], row[5], row[6], row[7], row[1],
+                                        datetime.fromisoformat(row[2]).timestamp(), answers, info.get("evidence")))
+        return records
+
+    def close(self):
+        self.conn.close()
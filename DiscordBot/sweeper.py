@@ -0,0 +1,60 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter
+
+
+class SessionSweeper:
+    '''
+    Expires in-progress sessions (report flows, mod reviews) that have been idle for too long.
+    Each kind of session lives in a dict owned by the bot and has its own idle timeout. The 
+    sweeper keeps a heap of deadlines; sessions record their own last_active time, so activity
+    doesn't touch the heap. When a deadline comes up for a session that was active since, it is
+    simply pushed back with a new deadline.
+    '''
+
+    def __init__(self, on_expire, interval=30.0):
+        self.on_expire = on_expire
+        self.interval = interval
+        self.kinds = {}
+        self.deadlines = []
+        self.counter = itertools.count()
+        self.expired = Counter()
+
+    def add_kind(self, kind, sessions, timeout):
+        self.kinds[kind] = (sessions, timeout)
+
+    def track(self, kind, key):
+        sessions, timeout = self.kinds[kind]
+        session = sessions[key]
+        heapq.heappush(self.deadlines, (session.last_active + timeout, next(self.counter), kind, key, session))
+
+    async def sweep(self, now=None):
+        now = time.monotonic() if now is None else now
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, _, kind, key, session = heapq.heappop(self.deadlines)
+            sessions, timeout = self.kinds[kind]
+
+            # Finished, or replaced by a newer session for the same user
+            if sessions.get(key) is not session:
+                continue
+
+            if session.last_active + timeout > now:
+                heapq.heappush(self.deadlines, (session.last_active + timeout, next(self.counter), kind, key, session))
+                continue
+
+            sessions.pop(key)
+            self.expired[kind] += 1
+            try:
+                await self.on_expire(kind, key, session)
+            except Exception as e:
+                print(f"Expiring {kind} session {key} failed: {e}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sweep()
+
+    def stats(self):
+        return {kind: {"live": len(sessions), "expired": self.expired[kind]} for kind, (sessions, _) in self.kinds.items()}
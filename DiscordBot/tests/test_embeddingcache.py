@@ -0,0 +1,51 @@
+import numpy as np
+
+from apis.embeddingcache import EmbeddingCache
+
+
+def vector(key, dim=3):
+    return np.full(dim, key, dtype=np.float32)
+
+
+def put(cache, *keys):
+    for key in keys:
+        cache.put_many([key], [vector(key)])
+
+
+def cached_keys(cache, keys):
+    return [key for key, found in zip(keys, cache.get_many(keys)) if found is not None]
+
+
+def test_ring_overwrites_oldest(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache"), capacity=4)
+    put(cache, 1, 2, 3, 4, 5, 6)
+    assert cached_keys(cache, range(1, 7)) == [3, 4, 5, 6]
+    assert all((found == vector(key)).all() for key, found in zip([3, 4, 5, 6], cache.get_many([3, 4, 5, 6])))
+
+
+def test_ring_order_survives_compaction(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache"), capacity=4)
+    # The 17th record is past 4 * capacity and compacts the index down to the 4 live rows
+    put(cache, *range(1, 18))
+    assert cache.records == 4
+    assert cached_keys(cache, range(1, 18)) == [14, 15, 16, 17]
+    # The next write still replaces the oldest row, not whichever row the compacted index starts with
+    put(cache, 18)
+    assert cached_keys(cache, range(1, 19)) == [15, 16, 17, 18]
+
+
+def test_other_processes_continue_the_ring(tmp_path):
+    path = str(tmp_path / "cache")
+    put(EmbeddingCache(path, capacity=4), 1, 2, 3)
+    other = EmbeddingCache(path, capacity=4)
+    assert cached_keys(other, [1, 2, 3]) == [1, 2, 3]
+    put(other, 4, 5)
+    assert cached_keys(EmbeddingCache(path, capacity=4), range(1, 6)) == [2, 3, 4, 5]
+
+
+def test_dimension_mismatch_is_not_cached(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache"), capacity=4)
+    put(cache, 1)
+    cache.put_many([2], [np.ones(5, dtype=np.float32)])
+    assert cached_keys(cache, [1, 2]) == [1]
+    assert cache.stats()["skipped"] == 1
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from apis.claimbuster import ClaimBuster
+from apis.httpclient import HttpClient
+
+
+async def fetch(handler, path="/", client=None, **kwargs):
+    # Starts a stub server with handler for every GET, returns what the client got from path
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    server = TestServer(app)
+    await server.start_server()
+    client = client or HttpClient(retries=2, backoff=0.01)
+    try:
+        return await client.get_json(f"http://{server.host}:{server.port}{path}", **kwargs)
+    finally:
+        await client.close()
+        await server.close()
+
+
+def failing(*statuses):
+    # A handler answering with each status in turn, then 200
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) <= len(statuses):
+            return web.Response(status=statuses[len(calls) - 1])
+        return web.json_response({"ok": True})
+
+    return handler, calls
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retries_transient_statuses(status):
+    handler, calls = failing(status, status)
+    assert asyncio.run(fetch(handler)) == {"ok": True}
+    assert len(calls) == 3
+
+
+def test_gives_up_after_retries():
+    handler, calls = failing(503, 503, 503)
+    with pytest.raises(aiohttp.ClientResponseError) as error:
+        asyncio.run(fetch(handler))
+    assert error.value.status == 503
+    assert len(calls) == 3
+
+
+def test_does_not_retry_client_errors():
+    handler, calls = failing(404)
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(fetch(handler))
+    assert len(calls) == 1
+
+
+async def slow(request):
+    await asyncio.sleep(1)
+    return web.json_response({"ok": True})
+
+
+def test_timeout():
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(fetch(slow, timeout=0.1, retries=0))
+
+
+def test_budget_stops_retries_before_the_deadline():
+    start = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(fetch(slow, timeout=0.2, retries=10, budget=0.5))
+    assert time.monotonic() - start < 0.9
+
+
+def test_claimbuster_escapes_the_claim_in_the_path():
+    claim = "5G/covid? 100% #proof & more"
+    seen = []
+
+    async def handler(request):
+        seen.append((request.raw_path, request.match_info["claim"]))
+        return web.json_response({"ok": True})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/fact_matcher/{claim}", handler)
+        server = TestServer(app)
+        await server.start_server()
+        claimbuster = ClaimBuster.__new__(ClaimBuster)
+        claimbuster.http = HttpClient(retries=0)
+        claimbuster.request_headers = {}
+        claimbuster.timeout = 1
+        claimbuster.budget = None
+        try:
+            url = claimbuster._endpoint_url(f"http://{server.host}:{server.port}/fact_matcher/{{claim}}", claim)
+            return await claimbuster._get_json(url)
+        finally:
+            await claimbuster.http.close()
+            await server.close()
+
+    assert asyncio.run(run()) == {"ok": True}
+    (raw_path, received), = seen
+    # The whole claim arrives as one path segment, yarl may leave characters like & unescaped
+    assert received == claim
+    assert raw_path.startswith("/fact_matcher/5G%2Fcovid%3F%20100%25%20%23proof")